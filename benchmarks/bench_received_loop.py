@@ -0,0 +1,116 @@
+#! /usr/bin/env python3
+# coding=utf-8
+
+"""
+ description:	benchmark TCMController.received_loop against a fake serial
+ 		port, comparing the legacy byte-at-a-time busy spin with the
+ 		blocking bulk-read framer.
+ usage:		python benchmarks/bench_received_loop.py [--frames N] [--idle S]
+"""
+
+
+import argparse
+import os
+import sys
+import threading
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tcmcore import FrameReader, TCMController
+
+
+REPLY = b'TC1:TCACTUALTEMP=25.30@1\r'
+
+
+class FakeSerial:
+    """In-memory stand-in for serial.Serial with blocking, timed reads."""
+
+    def __init__(self, timeout=0.1):
+        self.timeout = timeout
+        self._data = bytearray()
+        self._cond = threading.Condition()
+
+    @property
+    def in_waiting(self):
+        with self._cond:
+            return len(self._data)
+
+    def feed(self, data):
+        with self._cond:
+            self._data += data
+            self._cond.notify_all()
+
+    def read(self, size=1):
+        with self._cond:
+            if not self._data:
+                self._cond.wait(self.timeout)
+            chunk = bytes(self._data[:size])
+            del self._data[:size]
+            return chunk
+
+
+def legacy_received_loop(self):
+    # received_loop as it was before the FrameReader engine
+    msg = []
+    while self.running:
+        if self.packet_serial.in_waiting == 0:
+            continue
+        char = self.packet_serial.read(1)
+        if char == b'\r':
+            msg += char
+            self.on_packet_received(bytearray(msg[:-1]).decode())
+            msg = []
+            continue
+        msg += char
+
+
+def run_case(loop, frames, idle):
+    port = FakeSerial()
+    received = []
+    done = threading.Event()
+
+    def on_packet_received(packet):
+        received.append(packet)
+        if len(received) == frames:
+            done.set()
+
+    stub = types.SimpleNamespace(packet_serial=port, running=True,
+                                 frame_reader=FrameReader(port),
+                                 on_packet_received=on_packet_received)
+    thread = threading.Thread(target=loop, args=(stub,))
+    thread.start()
+
+    # idle: nothing on the wire
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    time.sleep(idle)
+    idle_cpu = (time.process_time() - cpu) / (time.perf_counter() - wall)
+
+    # burst: many modules answering back-to-back
+    wall = time.perf_counter()
+    port.feed(REPLY * frames)
+    done.wait()
+    elapsed = time.perf_counter() - wall
+
+    stub.running = False
+    thread.join()
+    return idle_cpu, frames / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='received_loop benchmark')
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--idle', type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f"{'loop':<10}{'idle CPU':>12}{'frames/s':>14}")
+    for name, loop in (('legacy', legacy_received_loop),
+                       ('framer', TCMController.received_loop)):
+        idle_cpu, rate = run_case(loop, args.frames, args.idle)
+        print(f"{name:<10}{idle_cpu * 100:>11.1f}%{rate:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#! /usr/bin/env python3
+# coding=utf-8
+
+"""
+ description:	micro-benchmark of the reply parser on reply corpora, comparing
+ 		the former str-based if/elif analyze_TCM_reply with what
+ 		TCMController does per frame now: route it by its address bytes
+ 		to the request in flight and run that request's reply matcher.
+ usage:		python benchmarks/bench_reply_parser.py [--corpus FILE ...] [--rounds N]
+"""
+
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tcmcore import CommandRequest
+
+
+CORPORA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpora')
+
+
+def load_corpus(path):
+    replies = []
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith(b'#'):
+                continue
+            reply_type, frame = line.split(b' ', 1)
+            replies.append((reply_type.decode(), frame))
+    return replies
+
+
+class LegacyStatus:
+    def __init__(self):
+        self.instrumentIndex = 0
+        self.percent = 0
+        self.reply = ''
+        self.value_name = ''
+        self.value = 0
+        self.status = 'FINISH'
+
+
+class LegacyParser:
+    '''
+    analyze_TCM_reply as it was before the table-driven parser: the frame is
+    decoded to str first, then each branch re-indexes self.instruments.
+    processResult.emit() and print() are left out.
+    '''
+
+    def __init__(self):
+        self.instrumentstatus = LegacyStatus()
+        self.instruments = [['', '']]
+
+    def parse(self, reply_type, frame):
+        self.instruments[0][1] = reply_type
+        self.analyze_TCM_reply(frame.decode())
+        return self.instrumentstatus.status
+
+    def analyze_TCM_reply(self, reply):
+        self.instrumentstatus.reply = reply
+
+        if self.instruments[self.instrumentstatus.instrumentIndex][1] == 'A':
+            if reply[4:11] == 'REPLY=1':
+                self.instrumentstatus.status = 'OK'
+            else:
+                self.instrumentstatus.status = 'FAIL'
+        elif self.instruments[self.instrumentstatus.instrumentIndex][1] == 'P':
+            pos_1 = reply.find('=', 0)
+            pos_2 = reply.find('@', 0)
+            if pos_1 != -1 and pos_2 != -1:
+                if reply[pos_1 + 1:pos_2] == '100':
+                    self.instrumentstatus.percent = reply[pos_1 + 1:pos_2]
+                    self.instrumentstatus.value = 100
+                    self.instrumentstatus.status = 'OK'
+                else:
+                    self.instrumentstatus.percent = reply[pos_1 + 1:pos_2]
+                    self.instrumentstatus.status = 'CONTINUE'
+            else:
+                self.instrumentstatus.status = 'FAIL'
+        elif self.instruments[self.instrumentstatus.instrumentIndex][1] == 'V':
+            if reply[4:11] == 'REPLY=2':
+                self.instrumentstatus.status = 'FAIL'
+            else:
+                pos_1 = reply.find('=', 0)
+                pos_2 = reply.find('@', 0)
+                if pos_1 != -1 and pos_2 != -1:
+                    self.instrumentstatus.value = reply[pos_1 + 1:pos_2]
+                    self.instrumentstatus.status = 'OK'
+                else:
+                    self.instrumentstatus.status = 'FAIL'
+        elif self.instruments[self.instrumentstatus.instrumentIndex][1] == 'S':
+            if reply[4:11] == 'REPLY=8':
+                self.instrumentstatus.status = 'OK'
+            else:
+                self.instrumentstatus.status = 'FAIL'
+        elif self.instruments[self.instrumentstatus.instrumentIndex][1] == 'R':
+            if reply[4:11] == 'REPLY=1':
+                self.instrumentstatus.status = 'OK'
+            else:
+                self.instrumentstatus.status = 'FAIL'
+        else:
+            self.instrumentstatus.status = 'FAIL'
+
+
+def command_for(reply_type, frame):
+    '''
+    A command the frame answers, to build the request in flight from.
+    '''
+    head, _, address = frame.decode().rpartition('@')
+    module, _, rest = head.partition(':')
+    register = rest.partition('=')[0]
+    if reply_type in ('V', 'P'):
+        if register == 'REPLY':
+            register = 'TCACTUALTEMP'
+        return f'{module}:{register}?@{address}'
+    return f'{module}:TCSW=1@{address}'
+
+
+def in_flight(reply_type, frame):
+    # routes of TCMController with the frame's request in flight
+    request = CommandRequest(command_for(reply_type, frame), reply_type)
+    return {request.address_key: request}
+
+
+def matcher_parse(frame, routes):
+    # what analyze_TCM_reply does per frame before completing the request
+    head, _, address = frame.rpartition(b'@')
+    request = routes.get(address) or routes.get(b'0')
+    status, value = request.match(head)
+    return status
+
+
+def measure(cases, rounds, repeat=7):
+    '''
+    cases: [(parse, [args, ...]), ...]; returns parses per second of each.
+    '''
+    # interleaved runs, best of each: the least disturbed by other load
+    best = [float('inf')] * len(cases)
+    for _ in range(repeat):
+        for index, (parse, inputs) in enumerate(cases):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for args in inputs:
+                    parse(*args)
+            best[index] = min(best[index], time.perf_counter() - start)
+    return [rounds * len(cases[0][1]) / elapsed for elapsed in best]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='reply parser benchmark')
+    parser.add_argument('--corpus', action='append',
+                        help='reply corpus file, "<type> <frame>" per line (default: benchmarks/corpora/*.txt)')
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    for path in args.corpus or sorted(glob.glob(os.path.join(CORPORA, '*.txt'))):
+        replies = load_corpus(path)
+        legacy_parse = LegacyParser().parse
+        routed = [(frame, in_flight(reply_type, frame)) for reply_type, frame in replies]
+        for (reply_type, frame), (_, routes) in zip(replies, routed):
+            old = legacy_parse(reply_type, frame)
+            new = matcher_parse(frame, routes)
+            if old != new:
+                print(f"mismatch on {frame!r}: {old} != {new}")
+
+        legacy, matcher = measure([(legacy_parse, replies), (matcher_parse, routed)], args.rounds)
+        print(f"{os.path.basename(path)}: {len(replies)} replies")
+        print(f"  legacy  {legacy:>12.0f} replies/s")
+        print(f"  matcher {matcher:>12.0f} replies/s  ({matcher / legacy:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#! /usr/bin/env python3
+# coding=utf-8
+
+"""
+ description:	end-to-end throughput and latency benchmark. Drives
+ 		ControllerWrapper.write_parameters and read_parameters_batch
+ 		against simulated modules on pseudo-terminals and reports
+ 		commands/s, round-trip percentiles, retries, timeouts and CPU use.
+ usage:		python benchmarks/bench_throughput.py [--buses 2] [--modules 30]
+ 		    [--mix write,read] [--latency 0.005] [--output results.json]
+"""
+
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulator import TCMSimulator
+from tcmcore import ControllerWrapper
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Collector:
+    '''
+    Finish listener gathering every request the controllers settle.
+    '''
+
+    def __init__(self):
+        self.requests = []
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+
+    def __call__(self, request):
+        with self.changed:
+            self.requests.append(request)
+            self.changed.notify_all()
+
+    def wait_for(self, count):
+        with self.changed:
+            self.changed.wait_for(lambda: len(self.requests) >= count)
+
+    def take(self):
+        with self.lock:
+            requests, self.requests = self.requests, []
+            return requests
+
+
+def summarize(requests, wall, cpu):
+    rtts = sorted(request.rtt * 1000.0 for request in requests if request.rtt is not None)
+    return {
+        'commands': len(requests),
+        'seconds': wall,
+        'commands_per_second': len(requests) / wall if wall else 0.0,
+        'rtt_ms': {
+            'p50': percentile(rtts, 0.50),
+            'p95': percentile(rtts, 0.95),
+            'p99': percentile(rtts, 0.99),
+            'max': rtts[-1] if rtts else None,
+        },
+        'retries': sum(request.retry for request in requests),
+        'failures': sum(request.status == 'FAIL' for request in requests),
+        'timeouts': sum(request.status == 'TIMEOUT' for request in requests),
+        'cpu_percent': 100.0 * cpu / wall if wall else 0.0,
+    }
+
+
+def run_write(wrapper, collector, rows):
+    report = wrapper.write_parameters(rows)
+    collector.wait_for(report['commands'])
+
+
+def run_read(wrapper, collector, parameters, addresses):
+    wrapper.read_parameters_batch(parameters, addresses)
+
+
+def version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='end-to-end throughput benchmark')
+    parser.add_argument('--buses', type=int, default=1, help='simulated serial ports')
+    parser.add_argument('--modules', type=int, default=30, help='modules per bus')
+    parser.add_argument('--window', type=int, default=1, help='pipeline window per bus')
+    parser.add_argument('--mix', default='write,read', help='scenarios to run, in order')
+    parser.add_argument('--read-parameters', default='temperature1,temperature2,adjusttemperature1,adjusttemperature2')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--baud-rate', type=int, default=57600)
+    parser.add_argument('--reply-timeout', type=float, default=1.0)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    simulators = []
+    port_map = {}
+    for bus in range(args.buses):
+        addresses = range(bus * args.modules + 1, (bus + 1) * args.modules + 1)
+        simulator = TCMSimulator(addresses, args.latency, args.jitter, args.drop_rate,
+                                 args.error_rate, args.baud_rate, seed=bus)
+        port = simulator.start()
+        simulators.append(simulator)
+        port_map.update((str(address), port) for address in addresses)
+    addresses = sorted(int(address) for address in port_map)
+    rows = [{'Address': str(address), 'ModuleType': 'M207',
+             'AdjustTemperature1': '30', 'AdjustTemperature2': '31'} for address in addresses]
+    parameters = args.read_parameters.split(',')
+
+    wrapper = ControllerWrapper(window=args.window, ports=[s.port for s in simulators], port_map=port_map)
+    collector = Collector()
+    for controller in wrapper.controllers:
+        controller.reply_timeout = args.reply_timeout
+        controller.finish_listeners.append(collector)
+
+    results = {}
+    try:
+        for scenario in args.mix.split(','):
+            requests = []
+            wall = cpu = 0.0
+            for _ in range(args.rounds):
+                start_wall, start_cpu = time.perf_counter(), time.process_time()
+                # controller progress prints would dominate the measurement
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if scenario == 'write':
+                        run_write(wrapper, collector, rows)
+                    elif scenario == 'read':
+                        run_read(wrapper, collector, parameters, addresses)
+                    else:
+                        raise ValueError(f"Unknown scenario: {scenario}")
+                wall += time.perf_counter() - start_wall
+                cpu += time.process_time() - start_cpu
+                requests += collector.take()
+            results[scenario] = summarize(requests, wall, cpu)
+    finally:
+        wrapper.close()
+        for simulator in simulators:
+            simulator.stop()
+
+    print(f"{'scenario':<10}{'cmd/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'retries':>9}{'timeouts':>10}{'CPU':>8}")
+    for scenario, result in results.items():
+        rtt = result['rtt_ms']
+        print(f"{scenario:<10}{result['commands_per_second']:>10.1f}"
+              f"{rtt['p50'] or 0:>10.2f}{rtt['p95'] or 0:>10.2f}{rtt['p99'] or 0:>10.2f}"
+              f"{result['retries']:>9}{result['timeouts']:>10}{result['cpu_percent']:>7.1f}%")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'version': version(), 'timestamp': time.time(),
+                       'config': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+ description:	compiled command plans. A configuration or instrument CSV is
+ 		turned once into its commands, reply types and encoded wire
+ 		frames, cached by the file's content hash in memory and on disk,
+ 		so applying the same file again skips parsing and encoding.
+"""
+
+
+import csv
+import hashlib
+import io
+import json
+import os
+
+from array import array
+
+from tcmcore import address_of, assemble_commands, assemble_instrument
+
+
+DEFAULT_PLAN_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'temperaturemonitor', 'plans')
+# bump whenever compile_rows, assemble_commands or assemble_instrument change
+# the commands they produce, so plans compiled before are not reused
+PLAN_VERSION = 1
+
+
+class CommandPlan:
+    '''
+    Commands of one CSV file. All frames (CR included) live in one bytes
+    buffer, frame i being wire[offsets[i]:offsets[i + 1]]; reply_types holds
+    one character per command and ports the row's optional Port column.
+    '''
+
+    def __init__(self, commands, reply_types, ports = None, digest = ''):
+        self.commands = list(commands)
+        self.reply_types = ''.join(reply_types)
+        self.ports = list(ports) if ports is not None else [''] * len(self.commands)
+        self.digest = digest
+        self.offsets = array('I', [0])
+        frames = []
+        for command in self.commands:
+            frame = command.encode('utf-8') + b'\r'
+            frames.append(frame)
+            self.offsets.append(self.offsets[-1] + len(frame))
+        self.wire = b''.join(frames)
+
+    def __len__(self):
+        return len(self.commands)
+
+    def frame(self, index):
+        return self.wire[self.offsets[index]:self.offsets[index + 1]]
+
+    def entries(self, indexes = None):
+        '''
+        [command, reply_type, frame] lists as taken by TCMController.set_commands.
+        '''
+        if indexes is None:
+            indexes = range(len(self.commands))
+        return [[self.commands[i], self.reply_types[i], self.frame(i)] for i in indexes]
+
+    def addresses(self):
+        return [address_of(command) for command in self.commands]
+
+    def to_json(self):
+        return {'version': PLAN_VERSION, 'digest': self.digest, 'commands': self.commands,
+                'reply_types': self.reply_types, 'ports': self.ports}
+
+    @classmethod
+    def from_json(cls, data):
+        if data.get('version') != PLAN_VERSION:
+            raise ValueError(f"Plan version {data.get('version')}, expected {PLAN_VERSION}")
+        return cls(data['commands'], data['reply_types'], data['ports'], data['digest'])
+
+
+def compile_rows(rows, digest = ''):
+    '''
+    Compiles configuration rows (Address, ModuleType, ...) or instrument rows
+    (Device, Module, Register, Type) into a CommandPlan.
+    '''
+    commands, reply_types, ports = [], [], []
+    for row in rows:
+        if 'ModuleType' in row:
+            command_sets = assemble_commands(row)
+        else:
+            command_set = assemble_instrument(row)
+            command_sets = [command_set] if command_set else []
+        for command, reply_type in command_sets:
+            commands.append(command)
+            reply_types.append(reply_type)
+            ports.append(row.get('Port') or '')
+    return CommandPlan(commands, reply_types, ports, digest)
+
+
+_plans = {}  # (digest, PLAN_VERSION) -> CommandPlan, plans compiled or loaded by this process
+
+
+def compile_plan(filepath, cache_dir = DEFAULT_PLAN_CACHE, encoding = 'utf-8'):
+    '''
+    Returns the CommandPlan of a CSV file. Plans are looked up by the SHA-256
+    of the file content and PLAN_VERSION, first in this process, then in
+    cache_dir (None disables the disk cache); only unseen content is parsed.
+    '''
+    with open(filepath, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+    key = (digest, PLAN_VERSION)
+    plan = _plans.get(key)
+    if plan is not None:
+        return plan
+
+    cache_path = os.path.join(cache_dir, f'{digest}-v{PLAN_VERSION}.json') if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                plan = CommandPlan.from_json(json.load(f))
+        except (OSError, ValueError, KeyError):
+            plan = None
+    if plan is None:
+        rows = csv.DictReader(io.StringIO(content.decode(encoding), newline=''))
+        plan = compile_rows(rows, digest)
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            temp = cache_path + '.tmp'
+            with open(temp, 'w') as f:
+                json.dump(plan.to_json(), f)
+            os.replace(temp, cache_path)
+    _plans[key] = plan
+    return plan
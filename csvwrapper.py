@@ -1,27 +1,105 @@
 import csv
-from typing import List, Dict, Optional
+import json
+import os
+from bisect import insort
+from typing import List, Dict, Optional, Tuple
 
 class CSVHandler:
-    def __init__(self, filepath: str, delimiter: str = ',', encoding: str = 'utf-8'):
+    def __init__(self, filepath: str, delimiter: str = ',', encoding: str = 'utf-8',
+                 cached: bool = False, index_columns: Optional[List[str]] = None,
+                 journal: bool = False, journal_max_bytes: int = 1 << 20):
         """
         Initializes the CSVHandler instance.
 
         :param filepath: Path to the CSV file.
         :param delimiter: Character separating values in the CSV file (default is ',').
         :param encoding: File encoding (default is 'utf-8').
+        :param cached: If True, filter_data, update_row and get_column work on a table parsed once
+                       and kept in memory; the file is re-read only when its mtime or size changes.
+        :param index_columns: Columns to keep hash indexes on in cached mode (e.g. ['Address', 'Device']),
+                              so conditions on them do not scan the whole table.
+        :param journal: If True, update_row and update_rows append their changes to `<filepath>.journal`
+                        instead of rewriting the file; read_csv replays the journal over the file.
+        :param journal_max_bytes: Journal size at which it is compacted into the file.
         """
         self.filepath = filepath
         self.delimiter = delimiter
         self.encoding = encoding
+        self.cached = cached
+        self.index_columns = list(index_columns or [])
+        self._signature = None  # (mtime, size) of the file and journal the table was parsed from
+        self._rows: List[Dict[str, str]] = []
+        self._columns: Dict[str, List[str]] = {}  # column name -> values, built on first get_column
+        self._indexes: Dict[str, Dict[str, List[int]]] = {}  # column name -> value -> row positions
+        self.journal_path = filepath + '.journal' if journal else None
+        self.journal_max_bytes = journal_max_bytes
+
+    def _file_signature(self):
+        signature = []
+        for path in (self.filepath, self.journal_path):
+            try:
+                stat = os.stat(path) if path else None
+            except OSError:
+                stat = None
+            signature.append(None if stat is None else (stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def _table(self) -> List[Dict[str, str]]:
+        """
+        Returns the cached rows, parsing the file again first if it changed on disk.
+        """
+        signature = self._file_signature()
+        if signature != self._signature:
+            self._rows = self.read_csv()
+            self._signature = signature
+            self._columns = {}
+            self._indexes = {}
+            for column in self.index_columns:
+                index = self._indexes[column] = {}
+                for position, row in enumerate(self._rows):
+                    index.setdefault(row.get(column), []).append(position)
+        return self._rows
+
+    def _candidates(self, condition: Dict[str, str]):
+        """
+        Positions of the cached rows that may match the condition, narrowed by the
+        most selective indexed column in it.
+        """
+        indexed = [self._indexes[key].get(value, []) for key, value in condition.items()
+                   if key in self._indexes]
+        if indexed:
+            return min(indexed, key=len)
+        return range(len(self._rows))
 
     def read_csv(self, as_dict: bool = True) -> List[Dict[str, str]]:
         """
-        Reads the CSV file and returns its content.
+        Reads the CSV file and returns its content, with the journal (if any) applied.
 
         :param as_dict: If True, returns each row as a dictionary with headers as keys. 
                         If False, returns rows as lists.
         :return: List of rows as dictionaries or lists based on `as_dict` parameter.
         """
+        data = self._parse_csv(as_dict)
+        batches = self._read_journal()
+        if not batches or not data:
+            return data
+        try:
+            if as_dict:
+                rows = data
+            else:
+                header = data[0]
+                rows = [dict(zip(header, row)) for row in data[1:]]
+            # one batch per update_rows call, replayed in the order they were made
+            for updates in batches:
+                self._apply_updates(rows, updates)
+            if as_dict:
+                return data
+            return [header] + [[row.get(column, '') for column in header] for row in rows]
+        except KeyError as e:
+            print(f"Key error: {e} - The journal {self.journal_path} does not match the CSV headers.")
+            return data
+
+    def _parse_csv(self, as_dict: bool = True):
         try:
             with open(self.filepath, mode='r', newline='', encoding=self.encoding) as file:
                 try:
@@ -44,36 +122,53 @@ class CSVHandler:
             print(f"An unexpected error occurred while reading the CSV: {e}")
             return []
 
-    def write_csv(self, data: List[Dict[str, str]], fieldnames: List[str], mode: str = 'w'):
+    def write_csv(self, data: List[Dict[str, str]], fieldnames: List[str], mode: str = 'w') -> bool:
         """
         Writes data to the CSV file. If the file doesn't exist, it will be created.
 
         :param data: List of dictionaries containing the data to write.
         :param fieldnames: List of fieldnames (headers) for the CSV file.
         :param mode: Mode to open the file ('w' for write, 'a' for append).
+        :return: True if the data was written, False otherwise.
         """
+        # a rewrite goes to a temporary file renamed over the original, so a crash
+        # leaves either the old or the new content
+        path = self.filepath + '.tmp' if mode == 'w' else self.filepath
+        written = False
         try:
-            with open(self.filepath, mode=mode, newline='', encoding=self.encoding) as file:
-                try:
-                    writer = csv.DictWriter(file, fieldnames=fieldnames, delimiter=self.delimiter)
-                    if mode == 'w':  # Write header only if file is being created or overwritten
-                        writer.writeheader()
-                    writer.writerows(data)
-                except csv.Error as e:
-                    print(f"CSV error: {e}")
+            with open(path, mode=mode, newline='', encoding=self.encoding) as file:
+                writer = csv.DictWriter(file, fieldnames=fieldnames, delimiter=self.delimiter)
+                if mode == 'w':  # Write header only if file is being created or overwritten
+                    writer.writeheader()
+                writer.writerows(data)
+                file.flush()
+                os.fsync(file.fileno())
+            if mode == 'w':
+                os.replace(path, self.filepath)
+            written = True
+        except csv.Error as e:
+            print(f"CSV error: {e}")
         except IOError as e:
             print(f"I/O error: {e}")
         except Exception as e:
             print(f"An unexpected error occurred while writing to the CSV: {e}")
+        finally:
+            if mode == 'w' and not written:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return written
 
-    def append_csv(self, data: List[Dict[str, str]], fieldnames: List[str]):
+    def append_csv(self, data: List[Dict[str, str]], fieldnames: List[str]) -> bool:
         """
         Appends data to the existing CSV file.
 
         :param data: List of dictionaries containing the data to append.
         :param fieldnames: List of fieldnames (headers) for the CSV file.
+        :return: True if the data was written, False otherwise.
         """
-        self.write_csv(data, fieldnames, mode='a')
+        return self.write_csv(data, fieldnames, mode='a')
 
     def filter_data(self, condition: Dict[str, str]) -> List[Dict[str, str]]:
         """
@@ -82,11 +177,20 @@ class CSVHandler:
         :param condition: Dictionary where the key is the column name, and the value is the value to match.
         :return: List of filtered rows as dictionaries.
         """
-        data = self.read_csv()
+        if self.cached:
+            data = self._table()
+            candidates = self._candidates(condition)
+        else:
+            data = self.read_csv()
+            candidates = range(len(data))
         try:
             filtered_data = [
-                row for row in data if all(row[key] == value for key, value in condition.items())
+                data[position] for position in candidates
+                if all(data[position][key] == value for key, value in condition.items())
             ]
+            if self.cached:
+                # the cached rows must not be changed through the result
+                filtered_data = [dict(row) for row in filtered_data]
             return filtered_data
         except TypeError:
             print("Error: The condition dictionary must have the same keys as the CSV headers.")
@@ -103,30 +207,72 @@ class CSVHandler:
         :param updated_data: Dictionary containing the columns and new values to update.
         :return: True if the update is successful, False otherwise.
         """
-        data = self.read_csv()
+        return self.update_rows([(condition, updated_data)]) > 0
+
+    def update_rows(self, updates: List[Tuple[Dict[str, str], Dict[str, str]]]) -> int:
+        """
+        Applies many updates in one pass over the data and writes the result once
+        (or appends it to the journal).
+
+        :param updates: List of (condition, updated_data) pairs as taken by update_row. Conditions
+                        are matched against the rows as read; updates matching the same row are
+                        applied in list order.
+        :return: Number of rows changed.
+        """
+        updates = list(updates)
+        data = self._table() if self.cached else self.read_csv()
         try:
-            updated = False
-            for row in data:
-                if all(row[key] == value for key, value in condition.items()):
-                    row.update(updated_data)
-                    updated = True
-            if updated:
-                self.write_csv(data, fieldnames=list(data[0].keys()))  # Write updated data back to file
-            return updated
+            changed = self._apply_updates(data, updates)
+            if changed:
+                if self.journal_path:
+                    self._append_journal(updates)
+                elif not self.write_csv(data, fieldnames=list(data[0].keys())):  # Write updated data back to file
+                    self._signature = None  # the cached table no longer matches the file
+                    return 0
+                if self.cached:
+                    # our own write must not invalidate the table
+                    self._signature = self._file_signature()
+            return changed
         except KeyError as e:
             print(f"Key error: {e} - Make sure the keys in the condition and updated_data match the CSV headers.")
-            return False
+            self._signature = None  # the cached table may be half updated, parse it again
+            return 0
         except Exception as e:
             print(f"An unexpected error occurred while updating the CSV: {e}")
-            return False
+            self._signature = None
+            return 0
+
+    def compact(self):
+        """
+        Writes the journal into the CSV file and removes it.
+        """
+        if not self.journal_path or not os.path.exists(self.journal_path):
+            return
+        data = self.read_csv()
+        if data and not self.write_csv(data, fieldnames=list(data[0].keys())):
+            return  # keep the journal, the file still lacks its changes
+        # a crash at this point leaves the journal to be replayed once more over
+        # the compacted file; that repeats its assignments unless a batch matches
+        # a value only a later batch wrote
+        os.remove(self.journal_path)
+        if self.cached:
+            self._signature = self._file_signature()
 
     def get_column(self, column_name: str) -> List[str]:
         """
         Retrieves all values of a specific column.
 
         :param column_name: The name of the column to retrieve.
-        :return: List of values from the specified column.
+        :return: List of values from the specified column. In cached mode this is the cached list
+                 itself, shared between calls; do not modify it.
         """
+        if self.cached:
+            data = self._table()
+            column = self._columns.get(column_name)
+            if column is None:
+                column = [row[column_name] for row in data if column_name in row]
+                self._columns[column_name] = column
+            return column
         data = self.read_csv()
         try:
             return [row[column_name] for row in data if column_name in row]
@@ -136,3 +282,86 @@ class CSVHandler:
         except Exception as e:
             print(f"An unexpected error occurred while retrieving the column: {e}")
             return []
+
+    def _reindex(self, position: int, row: Dict[str, str], updated_data: Dict[str, str]):
+        """
+        Moves a cached row to its new index buckets before updated_data is applied to it.
+        """
+        for column, value in updated_data.items():
+            self._columns.pop(column, None)
+            index = self._indexes.get(column)
+            if index is None or row.get(column) == value:
+                continue
+            old = index.get(row.get(column))
+            if old is not None:
+                old.remove(position)
+                if not old:
+                    del index[row.get(column)]
+            insort(index.setdefault(value, []), position)
+
+    def _apply_updates(self, data: List[Dict[str, str]], updates: List[Tuple[Dict[str, str], Dict[str, str]]]) -> int:
+        """
+        Applies (condition, updated_data) pairs to rows in place. Conditions are grouped by the
+        columns they test, so each row costs one dictionary lookup per group however many
+        updates there are. Returns the number of rows changed.
+        """
+        groups: Dict[tuple, Dict[tuple, List[int]]] = {}  # condition columns -> condition values -> update numbers
+        for number, (condition, _) in enumerate(updates):
+            groups.setdefault(tuple(condition), {}).setdefault(tuple(condition.values()), []).append(number)
+
+        cached = self.cached and data is self._rows
+        if cached and all(any(key in self._indexes for key in condition) for condition, _ in updates):
+            positions = sorted({position for condition, _ in updates for position in self._candidates(condition)})
+        else:
+            positions = range(len(data))
+
+        changed = 0
+        for position in positions:
+            row = data[position]
+            matches = []
+            for columns, lookup in groups.items():
+                numbers = lookup.get(tuple(row[column] for column in columns))
+                if numbers:
+                    matches.extend(numbers)
+            if not matches:
+                continue
+            if len(groups) > 1:
+                matches.sort()
+            for number in matches:
+                updated_data = updates[number][1]
+                if cached:
+                    self._reindex(position, row, updated_data)
+                row.update(updated_data)
+            changed += 1
+        return changed
+
+    def _read_journal(self) -> List[List[Tuple[Dict[str, str], Dict[str, str]]]]:
+        """
+        Returns the journaled batches, one list of (condition, updated_data) pairs per
+        update_rows call, oldest first.
+        """
+        if not self.journal_path:
+            return []
+        try:
+            with open(self.journal_path, mode='r', encoding=self.encoding) as file:
+                batches = []
+                for line in file:
+                    try:
+                        batch = [(condition, updated_data) for condition, updated_data in json.loads(line)]
+                    except ValueError:
+                        # torn last line of an interrupted append
+                        break
+                    batches.append(batch)
+                return batches
+        except FileNotFoundError:
+            return []
+
+    def _append_journal(self, updates: List[Tuple[Dict[str, str], Dict[str, str]]]):
+        # one line per batch: its conditions were matched against the rows as they were before it
+        with open(self.journal_path, mode='a', encoding=self.encoding) as file:
+            file.write(json.dumps([[condition, updated_data] for condition, updated_data in updates]) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+            size = file.tell()
+        if size >= self.journal_max_bytes:
+            self.compact()
@@ -0,0 +1,143 @@
+"""
+ description:	bus and address discovery. Probes candidate serial ports in
+ 		parallel, scans module addresses on each with a cheap query and
+ 		a short reply timeout, and caches the resulting topology on disk
+ 		so later starts can skip the scan.
+ usage:		python discovery.py [--port /dev/ttyUSB0 ...] [--addresses 1-32] [--refresh]
+"""
+
+
+import argparse
+import json
+import os
+import threading
+import time
+
+from serial.tools import list_ports
+
+from tcmcore import TCMController, parse_addresses, split_reply
+
+
+PROBE_COMMAND = 'TC1:TCSW?'  # answered by every M207, changes nothing
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'temperaturemonitor', 'topology.json')
+
+
+def candidate_ports():
+    return [p.device for p in list_ports.comports()]
+
+
+def scan_port(port, addresses, baud_rate = 57600, timeout = 0.1, window = 1):
+    '''
+    Returns the addresses in `addresses` that answer on port, or None if the
+    port cannot be opened.
+    '''
+    try:
+        controller = TCMController(port, baud_rate, window)
+    except Exception as e:
+        print(f"Skipping {port}: {e}")
+        return None
+    # a module that is there answers within milliseconds; most probes time out
+    controller.verbose = False
+    controller.reply_timeout = timeout
+    controller.min_reply_timeout = timeout
+    controller.timeout_retries = 0
+    controller.start()
+    try:
+        requests = [(str(address), controller.submit(f'{PROBE_COMMAND}@{address}', 'V'))
+                    for address in addresses]
+        for _, request in requests:
+            request.wait()
+        # only a reply carrying the probed address proves a module is there
+        return [address for address, request in requests
+                if request.status == 'OK' and split_reply(request.reply)[1] == address]
+    finally:
+        controller.stop()
+
+
+def scan(ports, addresses, baud_rate = 57600, timeout = 0.1, window = 1):
+    '''
+    Scans all ports at the same time. Returns {port: [address, ...]} for the
+    ports on which at least one module answered.
+    '''
+    found = {}
+    lock = threading.Lock()
+
+    def worker(port):
+        answered = scan_port(port, addresses, baud_rate, timeout, window)
+        if answered:
+            with lock:
+                found[port] = answered
+
+    threads = [threading.Thread(target=worker, args=(port,)) for port in ports]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {port: found[port] for port in ports if port in found}
+
+
+def load_topology(cache_path, ports = None, max_age = None):
+    '''
+    Returns the cached {port: [address, ...]}, or None if there is no cache,
+    it is older than max_age seconds, or one of its ports is gone (or not
+    in `ports`, when given).
+    '''
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if max_age is not None and time.time() - cache.get('created', 0) > max_age:
+        return None
+    topology = cache.get('topology', {})
+    for port in topology:
+        if not os.path.exists(port) or (ports is not None and port not in ports):
+            return None
+    return topology
+
+
+def save_topology(cache_path, topology):
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    temp = cache_path + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump({'created': time.time(), 'topology': topology}, f, indent=2)
+    os.replace(temp, cache_path)
+
+
+def discover(ports = None, addresses = range(1, 33), cache_path = DEFAULT_CACHE,
+             refresh = False, max_age = None, timeout = 0.1):
+    '''
+    Returns {port: [address, ...]} of the modules found, from the cache when
+    it is still valid unless refresh is set. ports defaults to every serial
+    port the system lists; cache_path None disables the cache.
+    '''
+    if cache_path and not refresh:
+        topology = load_topology(cache_path, ports, max_age)
+        if topology:
+            return topology
+    topology = scan(ports if ports is not None else candidate_ports(), addresses, timeout=timeout)
+    if cache_path and topology:
+        save_topology(cache_path, topology)
+    return topology
+
+
+def port_map(topology):
+    '''
+    {port: [address, ...]} -> {address: port}, as taken by ControllerWrapper.
+    '''
+    return {address: port for port, addresses in topology.items() for address in addresses}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='find TCM modules on serial ports')
+    parser.add_argument('--port', action='append', dest='ports', help='port to scan (default: all)')
+    parser.add_argument('--addresses', default='1-32', help="addresses to scan, e.g. '1-32'")
+    parser.add_argument('--timeout', type=float, default=0.1, help='reply timeout per address')
+    parser.add_argument('--cache', default=DEFAULT_CACHE)
+    parser.add_argument('--refresh', action='store_true', help='ignore the cached topology')
+    args = parser.parse_args()
+
+    topology = discover(args.ports, parse_addresses(args.addresses), args.cache,
+                        args.refresh, timeout=args.timeout)
+    for port, addresses in topology.items():
+        print(f"{port}: {','.join(addresses)}")
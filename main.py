@@ -11,48 +11,137 @@
 
 import sys
 import csv
-from PyQt5.QtWidgets import QApplication, QWidget, QPushButton, QVBoxLayout, QFileDialog, QHBoxLayout, QListView, QMessageBox, QInputDialog, QTextEdit, QLabel
-from PyQt5.QtCore import QStringListModel
+import time
+import logging
+import argparse
+from collections import deque
+from PyQt5.QtWidgets import QApplication, QWidget, QPushButton, QVBoxLayout, QFileDialog, QHBoxLayout, QTableView, QMessageBox, QInputDialog, QPlainTextEdit, QLabel
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt, QTimer
 
-from csvwrapper import CSVHandler
 from tcmcontroller import ControllerWrapper
+from discovery import DEFAULT_CACHE, discover, port_map
 
 
-def assemble_instrument(instrument_dict):
-    device = instrument_dict['Device']
-    module = instrument_dict['Module']
-    register = instrument_dict['Register']
-    type = instrument_dict['Type']
+class RowTableModel(QAbstractTableModel):
+    '''
+    Table over the rows of a loaded CSV file (lists of strings, the first one
+    is the header), shared with the caller rather than copied. The view only
+    asks for visible cells, and rows are handed to it in chunks of
+    `fetch_size` as it scrolls.
+    '''
+
+    def __init__(self, fetch_size = 1000, parent = None):
+        super().__init__(parent)
+        self.fetch_size = fetch_size
+        self.rows = [[]]
+        self.loaded = 0  # rows the view knows about
+
+    @property
+    def header(self):
+        return self.rows[0]
+
+    def set_rows(self, data):
+        self.beginResetModel()
+        self.rows = data or [[]]
+        self.loaded = min(len(self.rows) - 1, self.fetch_size)
+        self.endResetModel()
+
+    def row(self, row_index):
+        return self.rows[row_index + 1]
+
+    def rowCount(self, parent = QModelIndex()):
+        return 0 if parent.isValid() else self.loaded
+
+    def columnCount(self, parent = QModelIndex()):
+        return 0 if parent.isValid() else len(self.header)
+
+    def canFetchMore(self, parent = QModelIndex()):
+        return not parent.isValid() and self.loaded < len(self.rows) - 1
+
+    def fetchMore(self, parent = QModelIndex()):
+        count = min(self.fetch_size, len(self.rows) - 1 - self.loaded)
+        if parent.isValid() or count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.loaded, self.loaded + count - 1)
+        self.loaded += count
+        self.endInsertRows()
+
+    def data(self, index, role = Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+        row = self.row(index.row())
+        return row[index.column()] if index.column() < len(row) else ''
+
+    def headerData(self, section, orientation, role = Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.header[section] if section < len(self.header) else None
+        return section + 1
+
+    def flags(self, index):
+        return super().flags(index) | Qt.ItemIsEditable
+
+    def setData(self, index, value, role = Qt.EditRole):
+        if not index.isValid() or role != Qt.EditRole:
+            return False
+        row = self.row(index.row())
+        row.extend([''] * (index.column() + 1 - len(row)))
+        row[index.column()] = value
+        self.dataChanged.emit(index, index)
+        return True
+
+    def set_row(self, row_index, new_row):
+        self.rows[row_index + 1] = new_row
+        # repaint only this row
+        self.dataChanged.emit(self.index(row_index, 0),
+                              self.index(row_index, max(len(self.header), 1) - 1))
 
-    if type == 'V':
-        return [f"{module}:{register}?@{device}", 'V'] 
-    else:
-        return None
 
 class CommandApp(QWidget):
-    def __init__(self, simulation = False):
+    # Results are queued and written to the log in one block per interval,
+    # keeping at most log_max_lines lines of scroll-back
+    log_interval_ms = 100
+    log_max_lines = 5000
+
+    def __init__(self, simulation = False, ports = None, aggregate_log = False, port_map = None):
+        '''
+        aggregate_log: show one line per value name and interval (last value
+                       and update rate) instead of every single result
+        port_map:      module address -> port, e.g. from discovery
+        '''
         super().__init__()
+        self.aggregate_log = aggregate_log
+        self.pending_log = deque(maxlen=self.log_max_lines)
+        self.channel_updates = {}  # value name -> [last value, updates this interval]
         self.init_ui()
 
-        self.controllerWrapper = ControllerWrapper(simulation) 
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start(self.log_interval_ms)
+        self.log_flushed = time.monotonic()
+
+        self.controllerWrapper = ControllerWrapper(simulation, ports=ports, port_map=port_map) 
 
-        if simulation is not True:
-            self.controllerWrapper.controller.processResult.connect(self.appendText)
+        for controller in self.controllerWrapper.controllers:
+            controller.processResult.connect(self.appendText)
 
     def __del__(self):
         pass
 
     def init_ui(self):
         # Create widgets
-        self.log_edit = QTextEdit(self)
+        self.log_edit = QPlainTextEdit(self)
+        self.log_edit.setReadOnly(True)
+        self.log_edit.setMaximumBlockCount(self.log_max_lines)
         self.load_button = QPushButton('Load CSV File', self)
         self.save_button = QPushButton('Save CSV File', self)
-        self.list_view = QListView(self)
+        self.table_view = QTableView(self)
         self.edit_button = QPushButton('Edit Selected Row', self)
         self.query_button = QPushButton('Query Data', self)
         self.clear_log_button = QPushButton('Clear Log', self)  
         self.log_label = QLabel('Log:', self)  # Label for log_edit
-        self.list_label = QLabel('List View:', self)  # Label for list_view
+        self.table_label = QLabel('Table View:', self)  # Label for table_view
 
         # Set up button actions
         self.load_button.clicked.connect(self.load_csv)
@@ -73,8 +162,8 @@ class CommandApp(QWidget):
         main_layout = QVBoxLayout()
         main_layout.addWidget(self.log_label)
         main_layout.addWidget(self.log_edit)
-        main_layout.addWidget(self.list_label)
-        main_layout.addWidget(self.list_view)
+        main_layout.addWidget(self.table_label)
+        main_layout.addWidget(self.table_view)
         main_layout.addLayout(button_layout)
 
         # Set the main layout
@@ -86,17 +175,18 @@ class CommandApp(QWidget):
         self.show()
 
         # Initialize model and view
-        self.model = QStringListModel()
-        self.list_view.setModel(self.model)
+        self.model = RowTableModel(parent=self)
+        self.table_view.setModel(self.model)
+        self.table_view.setSelectionBehavior(QTableView.SelectRows)
         self.data = []  # Store the loaded data in a list of rows
 
     def load_csv(self):
 
-        """Load data from a CSV file and populate the QListView"""
+        """Load data from a CSV file and populate the QTableView"""
         file_name, _ = QFileDialog.getOpenFileName(self, "Open CSV File", "", "CSV Files (*.csv);;All Files (*)")
 
         sample_command = f"Load data from {file_name}"
-        self.log_edit.append(sample_command)
+        self.pending_log.append(sample_command)
         
         if file_name:
             try:
@@ -104,20 +194,21 @@ class CommandApp(QWidget):
                     csv_reader = csv.reader(f)
                     self.data = [row for row in csv_reader]
 
-                # Convert each row to a string to display in the QListView
-                display_data = [",".join(row) for row in self.data]
-                self.model.setStringList(display_data)
+                # The model shares the rows, nothing is copied for display
+                self.model.set_rows(self.data)
 
                 print("CSV file loaded successfully.")
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Failed to load CSV file: {str(e)}")
+                return
 
-            handler = CSVHandler(file_name)
-            data = handler.read_csv()
+            # Same rows as dictionaries keyed by the header, without reading the file again
+            header = self.data[0] if self.data else []
+            data = [dict(zip(header, row)) for row in self.data[1:]]
             self.controllerWrapper.write_parameters(data)
 
     def save_csv(self):
-        """Save the current data in the QListView back to a CSV file"""
+        """Save the current data in the QTableView back to a CSV file"""
         file_name, _ = QFileDialog.getSaveFileName(self, "Save CSV File", "", "CSV Files (*.csv);;All Files (*)")
         
         if file_name:
@@ -129,19 +220,19 @@ class CommandApp(QWidget):
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Failed to save CSV file: {str(e)}")
             sample_command = "Save data into instruments.csv"
-            self.log_edit.append(sample_command)
+            self.pending_log.append(sample_command)
 
     def edit_row(self):
-        """Edit the selected row in the QListView"""
+        """Edit the selected row in the QTableView"""
         # Get the index of the selected item
-        index = self.list_view.selectedIndexes()
+        index = self.table_view.selectedIndexes()
         if not index:
             QMessageBox.warning(self, "No Selection", "Please select a row to edit.")
             return
 
         # Get the selected row from the model and display it in an input dialog
         row_index = index[0].row()
-        row_data = self.data[row_index]
+        row_data = self.model.row(row_index)
 
         # Convert the row to a comma-separated string for editing
         current_text = ",".join(row_data)
@@ -150,11 +241,8 @@ class CommandApp(QWidget):
         if ok and new_text:
             # Split the edited row by commas and update the data
             new_row = new_text.split(",")
-            self.data[row_index] = new_row
-
-            # Update the QListView display with the modified data
-            display_data = [",".join(row) for row in self.data]
-            self.model.setStringList(display_data)
+            # Update the row (self.data is shared with the model) and repaint it
+            self.model.set_row(row_index, new_row)
 
             print(f"Row updated: {new_row}")
         else:
@@ -165,18 +253,68 @@ class CommandApp(QWidget):
 
     def clear_log(self):
         """Clear the contents of log_edit"""
+        self.pending_log.clear()
+        self.channel_updates.clear()
         self.log_edit.clear()
 
     def closeEvent(self, event):
         self.controllerWrapper.close()
 
     def appendText(self, name, text):
-        self.log_edit.append(name + ': ' + text)
+        if self.aggregate_log and name != 'Action':
+            updates = self.channel_updates.setdefault(name, [text, 0])
+            updates[0] = text
+            updates[1] += 1
+            return
+        self.pending_log.append(name + ': ' + text)
+
+    def flush_log(self):
+        """Write the results queued since the last call to log_edit in one block"""
+        now = time.monotonic()
+        elapsed, self.log_flushed = now - self.log_flushed, now
+        for name, (text, count) in self.channel_updates.items():
+            self.pending_log.append(f"{name}: {text} ({count / elapsed:.1f}/s)")
+        self.channel_updates.clear()
+        if not self.pending_log:
+            return
+        lines = '\n'.join(self.pending_log)
+        self.pending_log.clear()
+        self.log_edit.appendPlainText(lines)
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    debug_flag = False
-    if len(sys.argv) == 2 and sys.argv[1] == '--simulation':
-        debug_flag = True
-    ex = CommandApp(debug_flag)
-    sys.exit(app.exec_())
+    # Configure logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--simulation', action='store_true',
+                        help='run against simulated modules on a pseudo-terminal')
+    parser.add_argument('--port', action='append', dest='ports',
+                        help='serial port to drive, repeat for several USB-serial adapters')
+    parser.add_argument('--discover', action='store_true',
+                        help='find ports and module addresses (cached between runs)')
+    parser.add_argument('--aggregate-log', action='store_true',
+                        help='log one line per value and interval instead of every result')
+    args, qt_args = parser.parse_known_args()
+
+    simulator = None
+    ports = args.ports
+    if args.simulation:
+        # the simulator is only needed for simulation runs
+        from simulator import TCMSimulator
+        simulator = TCMSimulator()
+        ports = [simulator.start()]
+        print(f"Simulating {len(simulator.modules)} modules on {ports[0]}")
+
+    addresses = None
+    if args.discover:
+        # simulated ports are new every run, never cache them
+        topology = discover(ports, cache_path=None if args.simulation else DEFAULT_CACHE)
+        ports = list(topology) or ports
+        addresses = port_map(topology)
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    ex = CommandApp(False, ports, args.aggregate_log, addresses)
+    code = app.exec_()
+    if simulator is not None:
+        simulator.stop()
+    sys.exit(code)
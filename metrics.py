@@ -0,0 +1,187 @@
+"""
+ description:	per-command latency, retry and timeout metrics for
+ 		TCMController, readable as a snapshot dict or exported as JSON
+ 		or Prometheus text (node_exporter textfile collector format).
+"""
+
+
+import json
+import os
+import threading
+
+from bisect import bisect_left
+
+
+# round-trip time bucket bounds in seconds
+DEFAULT_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+
+class Histogram:
+    def __init__(self, bounds = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, fraction):
+        '''
+        Upper bound of the bucket holding the given quantile, None if empty
+        (inf if it falls in the +Inf bucket).
+        '''
+        if self.count == 0:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def cumulative(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+class ControllerMetrics:
+    '''
+    Collects metrics from one or more TCMControllers:
+
+        metrics = ControllerMetrics()
+        metrics.attach(controller, '/dev/ttyUSB0')
+        metrics.snapshot()
+        metrics.write_prometheus('/var/lib/node_exporter/tcm.prom')
+
+    Recording runs on the controller thread as a finish listener and costs a
+    bisect and a few dictionary updates per command.
+    '''
+
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.controllers = {}  # port -> TCMController
+        self.latency = {}  # (port, type, address) -> Histogram
+        self.requests = {}  # (port, type, address, status) -> count
+        self.retries = {}  # (port, address) -> count
+        self.timeouts = {}  # (port, address) -> count
+        self.lock = threading.Lock()
+
+    def attach(self, controller, port):
+        self.controllers[port] = controller
+        controller.finish_listeners.append(lambda request: self.observe(port, request))
+
+    def observe(self, port, request):
+        with self.lock:
+            if request.rtt is not None and request.status != 'TIMEOUT':
+                key = (port, request.reply_type, request.address)
+                histogram = self.latency.get(key)
+                if histogram is None:
+                    histogram = self.latency[key] = Histogram(self.buckets)
+                histogram.observe(request.rtt)
+            key = (port, request.reply_type, request.address, request.status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if request.retry:
+                key = (port, request.address)
+                self.retries[key] = self.retries.get(key, 0) + request.retry
+            if request.status == 'TIMEOUT':
+                key = (port, request.address)
+                self.timeouts[key] = self.timeouts.get(key, 0) + 1
+
+    def _bus(self):
+        bus = {}
+        for port, controller in self.controllers.items():
+            bus[port] = {
+                'bytes_sent': controller.bytes_sent,
+                'bytes_received': controller.frame_reader.bytes_received,
+                'queue_depth': controller.queue_depth(),
+                'inflight': len(controller.inflight),
+            }
+        return bus
+
+    def snapshot(self):
+        '''
+        Returns all metrics as plain data (JSON serialisable).
+        '''
+        with self.lock:
+            latency = [{
+                'port': port,
+                'type': reply_type,
+                'address': address,
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'p50': histogram.quantile(0.50),
+                'p95': histogram.quantile(0.95),
+                'p99': histogram.quantile(0.99),
+                'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'],
+                                    histogram.cumulative())),
+            } for (port, reply_type, address), histogram in self.latency.items()]
+            requests = [{'port': port, 'type': reply_type, 'address': address,
+                         'status': status, 'count': count}
+                        for (port, reply_type, address, status), count in self.requests.items()]
+            retries = [{'port': port, 'address': address, 'count': count}
+                       for (port, address), count in self.retries.items()]
+            timeouts = [{'port': port, 'address': address, 'count': count}
+                        for (port, address), count in self.timeouts.items()]
+        return {'bus': self._bus(), 'latency': latency, 'requests': requests,
+                'retries': retries, 'timeouts': timeouts}
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            lines.append('# HELP tcm_request_duration_seconds Round-trip time of TCM commands.')
+            lines.append('# TYPE tcm_request_duration_seconds histogram')
+            for (port, reply_type, address), histogram in self.latency.items():
+                labels = _labels(port=port, type=reply_type, address=address)
+                for bound, total in zip(list(self.buckets) + ['+Inf'], histogram.cumulative()):
+                    lines.append(f'tcm_request_duration_seconds_bucket{{{labels},le="{bound}"}} {total}')
+                lines.append(f'tcm_request_duration_seconds_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'tcm_request_duration_seconds_count{{{labels}}} {histogram.count}')
+
+            lines.append('# HELP tcm_requests_total Finished TCM commands by outcome.')
+            lines.append('# TYPE tcm_requests_total counter')
+            for (port, reply_type, address, status), count in self.requests.items():
+                labels = _labels(port=port, type=reply_type, address=address, status=status)
+                lines.append(f'tcm_requests_total{{{labels}}} {count}')
+
+            for name, help_text, counters in (
+                    ('tcm_retries_total', 'Commands resent after a failed reply.', self.retries),
+                    ('tcm_timeouts_total', 'Commands that got no reply in time.', self.timeouts)):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for (port, address), count in counters.items():
+                    lines.append(f'{name}{{{_labels(port=port, address=address)}}} {count}')
+
+        bus = self._bus()
+        for name, field, kind, help_text in (
+                ('tcm_bytes_sent_total', 'bytes_sent', 'counter', 'Bytes written to the port.'),
+                ('tcm_bytes_received_total', 'bytes_received', 'counter', 'Bytes read from the port.'),
+                ('tcm_queue_depth', 'queue_depth', 'gauge', 'Commands waiting to be sent.'),
+                ('tcm_inflight', 'inflight', 'gauge', 'Commands waiting for their reply.')):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for port, values in bus.items():
+                lines.append(f'{name}{{{_labels(port=port)}}} {values[field]}')
+        return '\n'.join(lines) + '\n'
+
+    def _write(self, path, text):
+        # write and rename so readers never see a partial file
+        temp = path + '.tmp'
+        with open(temp, 'w') as f:
+            f.write(text)
+        os.replace(temp, path)
+
+    def write_prometheus(self, path):
+        self._write(path, self.to_prometheus())
+
+    def write_json(self, path):
+        self._write(path, json.dumps(self.snapshot(), indent=2))
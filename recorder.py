@@ -0,0 +1,224 @@
+"""
+ description:	rotating telemetry recorder. Samples are buffered in memory
+ 		and appended in bulk by a background thread to segment files of
+ 		fixed-width binary records, which read back as NumPy arrays
+ 		through np.memmap without parsing.
+"""
+
+
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from csvwrapper import CSVHandler
+
+
+# one sample; channel indexes the (address, parameter) table in channels.json
+RECORD_DTYPE = np.dtype([('timestamp', '<f8'), ('channel', '<u4'), ('value', '<f8')])
+
+
+def read_segment(path):
+    '''
+    Maps a segment file as a read-only structured array of RECORD_DTYPE.
+    A record torn by a crash at the end of the file is left out.
+    '''
+    count = os.path.getsize(path) // RECORD_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', shape=(count,))
+
+
+class TelemetryRecorder:
+    '''
+    Records samples into `directory` as segment-NNNNNN.rec files plus a
+    channels.json naming their channels. Its add() matches the
+    TelemetrySampler listener signature:
+
+        recorder = TelemetryRecorder('/var/lib/tcm', max_segment_seconds=3600)
+        recorder.start()
+        sampler.add_listener(recorder.add)
+        ...
+        recorder.stop()
+        timestamps, values = recorder.query('3', 'temperature1', start=time.time() - 600)
+
+    flush_interval:      seconds between background flushes
+    buffer_size:         samples that trigger a flush before the interval ends
+    max_segment_bytes:   segment size at which a new segment is started
+    max_segment_seconds: segment age at which a new segment is started
+    '''
+
+    def __init__(self, directory, flush_interval = 1.0, buffer_size = 65536,
+                 max_segment_bytes = 64 * 1024 * 1024, max_segment_seconds = 3600.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_seconds = max_segment_seconds
+        os.makedirs(directory, exist_ok=True)
+
+        self.channels_path = os.path.join(directory, 'channels.json')
+        self.channels = []  # channel -> [address, parameter]
+        if os.path.exists(self.channels_path):
+            with open(self.channels_path) as f:
+                self.channels = json.load(f)
+        self.channel_ids = {tuple(channel): index for index, channel in enumerate(self.channels)}
+        self.saved_channels = len(self.channels)
+
+        segments = self.segments()
+        self.segment_index = int(segments[-1][-10:-4]) + 1 if segments else 0
+        self.segment = None  # open file of the current segment
+        self.segment_started = 0.0
+
+        self.buffer = []  # (timestamp, channel, value) not yet flushed
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread_flush = None
+        self.samples = 0
+        self.flushes = 0
+
+    def add(self, address, parameter, value, timestamp = None):
+        '''
+        Buffers one sample. Returns False if value is not numeric.
+        '''
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+        if timestamp is None:
+            timestamp = time.time()
+        key = (str(address), parameter)
+        with self.lock:
+            channel = self.channel_ids.get(key)
+            if channel is None:
+                channel = self.channel_ids[key] = len(self.channels)
+                self.channels.append(list(key))
+            self.buffer.append((timestamp, channel, value))
+            full = len(self.buffer) >= self.buffer_size
+        if full:
+            self.wakeup.set()
+        return True
+
+    def start(self):
+        self.running = True
+        self.thread_flush = threading.Thread(target=self.flush_loop, daemon=True)
+        self.thread_flush.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread_flush:
+            self.thread_flush.join()
+        self.flush()
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def flush_loop(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes all buffered samples; returns how many were written.
+        '''
+        with self.flush_lock:
+            with self.lock:
+                buffer, self.buffer = self.buffer, []
+                channels = self.channels[:]
+            if not buffer:
+                return 0
+            if len(channels) > self.saved_channels:
+                # names must be on disk before records refer to them
+                temp = self.channels_path + '.tmp'
+                with open(temp, 'w') as f:
+                    json.dump(channels, f)
+                os.replace(temp, self.channels_path)
+                self.saved_channels = len(channels)
+
+            records = np.array(buffer, dtype=RECORD_DTYPE)
+            self._rotate(records.nbytes)
+            self.segment.write(records.tobytes())
+            self.segment.flush()
+            self.samples += len(records)
+            self.flushes += 1
+            return len(records)
+
+    def _rotate(self, incoming):
+        if self.segment is not None:
+            size = self.segment.tell()
+            too_big = size and size + incoming > self.max_segment_bytes
+            too_old = time.time() - self.segment_started >= self.max_segment_seconds
+            if not (too_big or too_old):
+                return
+            self.segment.close()
+        path = os.path.join(self.directory, f'segment-{self.segment_index:06d}.rec')
+        self.segment_index += 1
+        self.segment = open(path, 'ab')
+        self.segment_started = time.time()
+
+    def segments(self):
+        '''
+        Paths of all segment files, oldest first.
+        '''
+        return sorted(glob.glob(os.path.join(self.directory, 'segment-[0-9][0-9][0-9][0-9][0-9][0-9].rec')))
+
+    def channel(self, address, parameter):
+        with self.lock:
+            return self.channel_ids.get((str(address), parameter))
+
+    def query(self, address, parameter, start = None, end = None):
+        '''
+        Returns (timestamps, values) of one channel's flushed samples with
+        start <= timestamp <= end, in recording order.
+        '''
+        channel = self.channel(address, parameter)
+        timestamps, values = [], []
+        if channel is not None:
+            for path in self.segments():
+                records = read_segment(path)
+                mask = records['channel'] == channel
+                if start is not None:
+                    mask &= records['timestamp'] >= start
+                if end is not None:
+                    mask &= records['timestamp'] <= end
+                timestamps.append(records['timestamp'][mask])
+                values.append(records['value'][mask])
+        if not timestamps:
+            empty = np.empty(0, dtype=np.float64)
+            return empty, empty
+        return np.concatenate(timestamps), np.concatenate(values)
+
+    def export_csv(self, filepath, start = None, end = None):
+        '''
+        Writes the flushed samples as CSV with Timestamp, Address, Parameter
+        and Value columns; returns the number of rows.
+        '''
+        with self.lock:
+            channels = self.channels[:]
+        rows = []
+        for path in self.segments():
+            for timestamp, channel, value in read_segment(path).tolist():
+                if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+                    continue
+                address, parameter = channels[channel]
+                rows.append({'Timestamp': repr(timestamp), 'Address': address,
+                             'Parameter': parameter, 'Value': repr(value)})
+        CSVHandler(filepath).write_csv(rows, fieldnames=['Timestamp', 'Address', 'Parameter', 'Value'])
+        return len(rows)
+
+    def stats(self):
+        return {
+            'samples': self.samples,
+            'flushes': self.flushes,
+            'buffered': len(self.buffer),
+            'segments': len(self.segments()),
+            'channels': len(self.channels),
+        }
@@ -0,0 +1,185 @@
+"""
+ description:	periodic telemetry sampler. Polls parameters of
+ 		ControllerWrapper.name_map_to_parameters_request_command on many
+ 		module addresses, each parameter at its own rate.
+"""
+
+
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+
+class SampleTask:
+    def __init__(self, parameter_name, address, period):
+        self.parameter_name = parameter_name
+        self.address = str(address)
+        self.period = period
+        self.deadline = 0.0
+        self.request = None  # outstanding CommandRequest, if any
+        self.port = None  # port the outstanding read was queued on
+        self.samples = 0
+        self.failures = 0
+        self.missed = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+
+    def stats(self):
+        sent = self.samples + self.failures
+        return {
+            'rate': 1.0 / self.period,
+            'samples': self.samples,
+            'failures': self.failures,
+            'missed': self.missed,
+            'jitter_mean': self.jitter_total / sent if sent else 0.0,
+            'jitter_max': self.jitter_max,
+        }
+
+
+class TelemetrySampler:
+    '''
+    Keeps the bus busy with periodic reads. Due reads are sent in deadline
+    order; each port gets at most `depth` reads per pipeline slot queued in
+    its controller, so a backlog never builds up behind the bus. A read that
+    cannot be sent before its next period starts counts as a missed deadline;
+    jitter is how late a read was sent relative to its deadline.
+
+        sampler = TelemetrySampler(wrapper)
+        sampler.add('temperature1', range(1, 31), 5.0)
+        sampler.add('protectHitemperature1', range(1, 31), 1 / 60)
+        sampler.add_listener(lambda address, name, value, timestamp: ...)
+        sampler.start()
+    '''
+
+    def __init__(self, wrapper, depth = 2):
+        self.wrapper = wrapper
+        self.depth = depth
+        self.tasks = {}  # (address, parameter_name) -> SampleTask
+        self.listeners = []
+        self._heap = []
+        self._sequence = itertools.count()
+        self._completions = queue.Queue()
+        self._outstanding = {}  # port -> number of reads queued in its controller
+        self._lock = threading.Lock()
+        self.running = False
+        self.thread_sample = None
+
+    def add(self, parameter_name, addresses, rate):
+        '''
+        Samples parameter_name on each address `rate` times per second.
+        '''
+        if parameter_name not in self.wrapper.name_map_to_parameters_request_command:
+            raise ValueError(f"Unknown parameter: {parameter_name}")
+        if rate <= 0:
+            raise ValueError(f"Sample rate must be positive: {rate}")
+        now = time.monotonic()
+        with self._lock:
+            for address in addresses:
+                task = SampleTask(parameter_name, address, 1.0 / rate)
+                task.deadline = now
+                self.tasks[(task.address, parameter_name)] = task
+                heapq.heappush(self._heap, (task.deadline, next(self._sequence), task))
+        self._completions.put(None)
+
+    def remove(self, parameter_name, addresses):
+        with self._lock:
+            for address in addresses:
+                self.tasks.pop((str(address), parameter_name), None)
+
+    def add_listener(self, listener):
+        '''
+        listener(address, parameter_name, value, timestamp) runs on the
+        sampler thread for every successful read.
+        '''
+        self.listeners.append(listener)
+
+    def stats(self):
+        with self._lock:
+            return {key: task.stats() for key, task in self.tasks.items()}
+
+    def start(self):
+        self.running = True
+        self.thread_sample = threading.Thread(target=self.sample_loop)
+        self.thread_sample.start()
+
+    def stop(self):
+        self.running = False
+        self._completions.put(None)
+        if self.thread_sample:
+            self.thread_sample.join()
+
+    def _port_of(self, task):
+        if self.wrapper.pool is None:
+            return None
+        return self.wrapper.pool.port_for(task.address)
+
+    def _capacity(self, port):
+        if self.wrapper.pool is None:
+            return self.depth
+        return self.depth * self.wrapper.pool.controllers[port].window
+
+    def _on_done(self, task):
+        # runs on the controller thread: hand over, never block it
+        return lambda request: self._completions.put((task, request, time.time()))
+
+    def _collect(self, item):
+        task, request, timestamp = item
+        self._outstanding[task.port] -= 1
+        task.request = None
+        if request.status != 'OK':
+            task.failures += 1
+            return
+        task.samples += 1
+        for listener in self.listeners:
+            listener(task.address, task.parameter_name, request.value, timestamp)
+
+    def _dispatch(self, now):
+        deferred = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                entry = heapq.heappop(self._heap)
+                task = entry[2]
+                if self.tasks.get((task.address, task.parameter_name)) is not task:
+                    continue
+                port = self._port_of(task)
+                if task.request is not None or self._outstanding.get(port, 0) >= self._capacity(port):
+                    deferred.append(entry)
+                    continue
+                if now - task.deadline >= task.period:
+                    # the bus could not fit the read in before its next period
+                    skipped = int((now - task.deadline) // task.period)
+                    task.missed += skipped
+                    task.deadline += skipped * task.period
+                jitter = now - task.deadline
+                task.jitter_total += jitter
+                task.jitter_max = max(task.jitter_max, jitter)
+                self._outstanding[port] = self._outstanding.get(port, 0) + 1
+                task.port = port
+                task.request = self.wrapper.submit_read(
+                        task.parameter_name, task.address, self._on_done(task))
+                if task.request is None:
+                    self._outstanding[port] -= 1
+                task.deadline += task.period
+                heapq.heappush(self._heap, (task.deadline, next(self._sequence), task))
+            for entry in deferred:
+                heapq.heappush(self._heap, entry)
+            if deferred or not self._heap:
+                # woken by the next completion
+                return None
+            return max(0.0, self._heap[0][0] - now)
+
+    def sample_loop(self):
+        while self.running:
+            timeout = self._dispatch(time.monotonic())
+            try:
+                item = self._completions.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            while item is not None:
+                self._collect(item)
+                try:
+                    item = self._completions.get_nowait()
+                except queue.Empty:
+                    break
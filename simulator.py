@@ -0,0 +1,219 @@
+#! /usr/bin/env python3
+# coding=utf-8
+
+"""
+ description:	TCM module simulator on a pseudo-terminal. Speaks the
+ 		Module:Register?@addr / Module:Register=value@addr protocol for
+ 		many module addresses so TCMController can connect to it like
+ 		to a USB-serial adapter.
+ usage:		python simulator.py [--addresses 1-32] [--latency 0.01] ...
+"""
+
+
+import argparse
+import heapq
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+from tcmcore import parse_addresses
+
+
+class SimulatedModule:
+    '''
+    Registers of one M207 module, two channels.
+    '''
+
+    def __init__(self, address, autotune_sequence):
+        self.address = address
+        self.autotune_sequence = autotune_sequence
+        self.registers = {}
+        for channel in ('TC1', 'TC2'):
+            self.registers[channel] = {
+                'TCSW': '0',
+                'TCADJTEMP': '25',
+                'TCOTPHT': '70',
+                'TCACTUALVOLTAGE': '0.000',
+                'TCACTCUR': '0.000',
+            }
+        self.autotune = {}  # channel -> position in autotune_sequence
+
+    def read(self, channel, register, rng):
+        registers = self.registers[channel]
+        if register == 'TCACTUALTEMP':
+            # settles around the setpoint while the channel is switched on
+            target = float(registers['TCADJTEMP']) if registers['TCSW'] == '1' else 25.0
+            return f'{target + rng.uniform(-0.05, 0.05):.2f}'
+        if register == 'TCPIDAUTO':
+            # every progress poll replays the next step of the sequence
+            step = self.autotune.get(channel, 0)
+            self.autotune[channel] = min(step + 1, len(self.autotune_sequence) - 1)
+            return str(self.autotune_sequence[step])
+        return registers.get(register)
+
+    def write(self, channel, register, value):
+        if register == 'TCPIDAUTO':
+            self.autotune[channel] = 0
+            return True
+        if register not in self.registers[channel]:
+            return False
+        self.registers[channel][register] = value
+        return True
+
+
+class TCMSimulator:
+    '''
+    Simulated bus of TCM modules behind a pseudo-terminal; port is the path
+    to open with TCMController once start() returned.
+
+    latency:     seconds from the end of a command to its reply
+    jitter:      replies are delayed by a further uniform 0..jitter seconds
+    drop_rate:   share of commands that get no reply at all
+    error_rate:  share of commands answered with REPLY=2
+    baud_rate:   if set, replies take their transmission time on the bus, one
+                 after another, as all modules share the same wire
+    '''
+
+    def __init__(self, addresses = range(1, 33), latency = 0.005, jitter = 0.0,
+                 drop_rate = 0.0, error_rate = 0.0, baud_rate = None,
+                 autotune_sequence = (0, 10, 25, 40, 55, 70, 85, 95, 100), seed = None):
+        self.modules = {str(address): SimulatedModule(str(address), list(autotune_sequence))
+                        for address in addresses}
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.error_rate = error_rate
+        self.baud_rate = baud_rate
+        self.bus_free = 0.0  # monotonic time the last queued reply has been sent
+        self.rng = random.Random(seed)
+        self.port = None
+        self.commands = 0
+        self.master = None
+        self.slave = None
+        self.running = False
+        self.thread_serve = None
+
+    def start(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self.thread_serve = threading.Thread(target=self.serve_loop, daemon=True)
+        self.thread_serve.start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        if self.thread_serve:
+            self.thread_serve.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def answer(self, command):
+        '''
+        Returns the reply frame for one command (without CR), or None if the
+        command gets no reply.
+        '''
+        head, at, address = command.rpartition('@')
+        if not at:
+            return None
+        if address == '0' and self.modules:
+            # @0 is answered by the first module with its own address
+            address = next(iter(self.modules))
+        module = self.modules.get(address)
+        if module is None:
+            return None
+        channel, colon, register = head.partition(':')
+        if not colon or channel not in module.registers:
+            return f'{channel}:REPLY=2@{address}'
+        if self.error_rate and self.rng.random() < self.error_rate:
+            return f'{channel}:REPLY=2@{address}'
+
+        if '=' in register:
+            register, _, value = register.partition('=')
+            ok = module.write(channel, register, value)
+            return f'{channel}:REPLY={1 if ok else 2}@{address}'
+        if register.endswith('!'):
+            # EEPROM save
+            ok = register[:-1] in module.registers[channel]
+            return f'{channel}:REPLY={8 if ok else 2}@{address}'
+        register = register.rstrip('?')
+        value = module.read(channel, register, self.rng)
+        if value is None:
+            return f'{channel}:REPLY=2@{address}'
+        return f'{channel}:{register}={value}@{address}'
+
+    def _due(self, reply, now):
+        '''
+        Time the reply has been fully sent: the module answers after latency and
+        jitter, then waits for the bus if another reply is still being sent.
+        '''
+        due = now + self.latency
+        if self.jitter:
+            due += self.rng.uniform(0.0, self.jitter)
+        if self.baud_rate:
+            # 10 bits per byte on the wire, CR included
+            due = max(due, self.bus_free) + (len(reply) + 1) * 10.0 / self.baud_rate
+            self.bus_free = due
+        return due
+
+    def serve_loop(self):
+        received = bytearray()
+        outgoing = []  # heap of (due time, sequence, reply bytes)
+        sequence = 0
+        while self.running:
+            now = time.monotonic()
+            while outgoing and outgoing[0][0] <= now:
+                os.write(self.master, heapq.heappop(outgoing)[2])
+            timeout = 0.1
+            if outgoing:
+                timeout = min(timeout, max(0.0, outgoing[0][0] - now))
+
+            readable, _, _ = select.select([self.master], [], [], timeout)
+            if not readable:
+                continue
+            try:
+                received += os.read(self.master, 4096)
+            except OSError:
+                continue
+
+            while True:
+                end = received.find(b'\r')
+                if end == -1:
+                    break
+                command = bytes(received[:end]).decode('utf-8', 'replace')
+                del received[:end + 1]
+                self.commands += 1
+                if self.drop_rate and self.rng.random() < self.drop_rate:
+                    continue
+                reply = self.answer(command)
+                if reply is None:
+                    continue
+                sequence += 1
+                heapq.heappush(outgoing, (self._due(reply, time.monotonic()), sequence,
+                                          reply.encode('utf-8') + b'\r'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='TCM module simulator on a pseudo-terminal')
+    parser.add_argument('--addresses', default='1-32', help="module addresses, e.g. '1-32' or '1,2,5-8'")
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--baud-rate', type=int, default=None)
+    args = parser.parse_args()
+
+    simulator = TCMSimulator(parse_addresses(args.addresses), args.latency, args.jitter,
+                             args.drop_rate, args.error_rate, args.baud_rate)
+    print(f"Simulating {len(simulator.modules)} modules on {simulator.start()}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping...")
+        simulator.stop()
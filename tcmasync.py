@@ -0,0 +1,171 @@
+"""
+ description:	asyncio transport and client for TCM modules. Each port is
+ 		driven from the event loop through its file descriptor, so many
+ 		ports and thousands of outstanding queries share one thread.
+"""
+
+
+import asyncio
+import os
+
+import serial
+
+from tcmcore import FrameReader, reply_matcher, split_reply
+
+
+class AsyncTransport:
+    '''
+    Non-blocking serial link registered with the event loop. Received frames
+    are passed to on_frame(frame) as bytes, without the CR terminator.
+    '''
+
+    def __init__(self, port, baud_rate = 57600, loop = None):
+        self.loop = loop or asyncio.get_running_loop()
+        # timeout=0: pyserial opens the descriptor non-blocking
+        self.packet_serial = serial.Serial(port, baudrate=baud_rate, timeout=0)
+        self.fd = self.packet_serial.fileno()
+        self.framer = FrameReader(None)
+        self.on_frame = None
+        self._outgoing = bytearray()
+        self.loop.add_reader(self.fd, self._on_readable)
+
+    def _on_readable(self):
+        try:
+            chunk = os.read(self.fd, 4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        for frame in self.framer.feed(chunk):
+            if self.on_frame is not None:
+                self.on_frame(frame)
+
+    def _on_writable(self):
+        try:
+            written = os.write(self.fd, self._outgoing)
+        except (BlockingIOError, InterruptedError):
+            return
+        del self._outgoing[:written]
+        if not self._outgoing:
+            self.loop.remove_writer(self.fd)
+
+    def send(self, command):
+        data = command.encode('utf-8') + b'\r'
+        if self._outgoing:
+            self._outgoing += data
+            return
+        try:
+            written = os.write(self.fd, data)
+        except (BlockingIOError, InterruptedError):
+            written = 0
+        if written < len(data):
+            self._outgoing += data[written:]
+            self.loop.add_writer(self.fd, self._on_writable)
+
+    def close(self):
+        self.loop.remove_reader(self.fd)
+        if self._outgoing:
+            self.loop.remove_writer(self.fd)
+        self.packet_serial.close()
+
+
+class AsyncTCMClient:
+    '''
+    Sends TCM commands over an AsyncTransport and matches replies back to
+    them by module address, with up to `window` addresses in flight at once.
+    Any module may answer @0, so a command to @0 is only sent while nothing
+    else is in flight, and nothing else is sent while it is.
+
+        value = await client.query('TC1:TCACTUALTEMP?', 3)
+        ok = await client.write('TC1:TCADJTEMP=25', 3)
+    '''
+
+    def __init__(self, transport, window = 1, reply_timeout = 5.0):
+        self.transport = transport
+        self.transport.on_frame = self._on_frame
+        self.reply_timeout = reply_timeout
+        self._window = asyncio.Semaphore(window)
+        self._locks = {}  # address -> asyncio.Lock, one command per address
+        self._inflight = {}  # address -> (match, future)
+        self._bus = asyncio.Condition()  # guards _inflight for @0 exclusivity
+        self._zero_waiting = 0
+
+    def _on_frame(self, reply):
+        head, address = split_reply(reply)
+        # a query sent to @0 is answered by the module's own address
+        entry = self._inflight.get(address) or self._inflight.get('0')
+        if entry is None:
+            return
+        match, future = entry
+        result = match(head)
+        if result is None or future.done():
+            # e.g. a late reply to a request that already timed out
+            return
+        future.set_result(result + (reply,))
+
+    def _may_send(self, address):
+        if address == '0':
+            return not self._inflight
+        return '0' not in self._inflight and not self._zero_waiting
+
+    async def request(self, command, reply_type, address, timeout = None):
+        '''
+        Sends command@address and waits for its reply.
+        Returns (status, value, raw reply bytes); raises asyncio.TimeoutError
+        if the module does not answer within the reply timeout.
+        '''
+        address = str(address)
+        lock = self._locks.setdefault(address, asyncio.Lock())
+        async with lock, self._window:
+            future = self.transport.loop.create_future()
+            command = f'{command}@{address}'
+            async with self._bus:
+                if address == '0':
+                    # let the bus drain rather than wait for a gap in traffic
+                    self._zero_waiting += 1
+                    try:
+                        await self._bus.wait_for(lambda: self._may_send(address))
+                    finally:
+                        self._zero_waiting -= 1
+                        # others may have waited on it, e.g. if it was cancelled
+                        self._bus.notify_all()
+                else:
+                    await self._bus.wait_for(lambda: self._may_send(address))
+                self._inflight[address] = (reply_matcher(command, reply_type), future)
+            try:
+                self.transport.send(command)
+                return await asyncio.wait_for(future, timeout or self.reply_timeout)
+            finally:
+                del self._inflight[address]
+                async with self._bus:
+                    self._bus.notify_all()
+
+    async def query(self, command, address, timeout = None):
+        '''
+        Reads a value, e.g. query('TC1:TCACTUALTEMP?', 3).
+        Returns the value as float, or None if the module rejected the query.
+        '''
+        status, value, _ = await self.request(command, 'V', address, timeout)
+        return value if status == 'OK' else None
+
+    async def write(self, command, address, timeout = None):
+        '''
+        Sets a register, e.g. write('TC1:TCADJTEMP=25', 3). Returns True on REPLY=1.
+        '''
+        status, _, _ = await self.request(command, 'A', address, timeout)
+        return status == 'OK'
+
+    async def save(self, command, address, timeout = None):
+        '''
+        Stores a register to EEPROM, e.g. save('TC1:TCADJTEMP!', 3). Returns True on REPLY=8.
+        '''
+        status, _, _ = await self.request(command, 'S', address, timeout)
+        return status == 'OK'
+
+    def close(self):
+        self.transport.close()
+
+
+async def open_client(port, baud_rate = 57600, window = 1, reply_timeout = 5.0):
+    '''
+    Opens port on the running event loop and returns an AsyncTCMClient for it.
+    '''
+    return AsyncTCMClient(AsyncTransport(port, baud_rate), window, reply_timeout)
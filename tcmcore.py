@@ -0,0 +1,1274 @@
+"""
+ description:	serial and protocol core of the TCM controller, free of Qt.
+ 		Results are reported to plain callbacks (result_listeners,
+ 		finish_listeners); tcmcontroller adds the Qt signal on top.
+"""
+
+
+import serial
+from serial.tools import list_ports
+
+import os
+import random
+import threading
+import time
+
+from collections import OrderedDict, deque
+from functools import lru_cache
+
+from zlib import crc32
+
+from metrics import ControllerMetrics
+
+
+class InstrumentStatus:
+    def __init__(self):
+        self.reset_value()
+
+    def reset_value(self):
+        self.instrumentIndex = 0
+        self.MAXinstrument = 0
+        self.percent = 0
+        self.reply = b''
+        self.retry = 0
+        self.MAXretry = 5
+        self.value_name = ''
+        self.value = 0
+        # INIT:  
+        # PROCESS:
+        # OK
+        # FAIL
+        # FINISH
+        # CONTINUE 
+        self.status = 'FINISH'
+
+
+class FrameReader:
+    '''
+    Receive engine for the TCM serial link.
+
+    Blocks on the port until the first byte arrives (bounded by the port
+    timeout), drains everything else already received in the same call and
+    splits the stream on CR into frames, keeping partial frames in a reusable
+    buffer until their terminator arrives.
+    '''
+
+    def __init__(self, port, terminator=b'\r'):
+        self.port = port
+        self.terminator = terminator
+        self.buffer = bytearray()
+        self.bytes_received = 0
+
+    def read_frames(self):
+        '''
+        Returns the list of complete frames (without terminator) received by
+        this call, or an empty list if the port timed out.
+        '''
+        chunk = self.port.read(self.port.in_waiting or 1)
+        if not chunk:
+            return []
+        waiting = self.port.in_waiting
+        if waiting:
+            chunk += self.port.read(waiting)
+        return self.feed(chunk)
+
+    def feed(self, chunk):
+        '''
+        Appends received bytes and returns the frames they complete.
+        '''
+        self.bytes_received += len(chunk)
+        buffer = self.buffer
+        buffer += chunk
+        frames = []
+        start = 0
+        while True:
+            end = buffer.find(self.terminator, start)
+            if end == -1:
+                break
+            frames.append(bytes(buffer[start:end]))
+            start = end + 1
+        if start:
+            del buffer[:start]
+        return frames
+
+
+def address_of(frame):
+    '''
+    Returns the module address after the trailing '@' of a command, or '' if
+    there is none.
+    '''
+    pos = frame.rfind('@')
+    if pos == -1:
+        return ''
+    return frame[pos + 1:]
+
+
+def register_of(command):
+    '''
+    Returns the 'Module:Register' part of a command, e.g. 'TC1:TCADJTEMP' for
+    'TC1:TCADJTEMP=25@3', 'TC1:TCADJTEMP?@3' and 'TC1:TCADJTEMP!@3'.
+    '''
+    end = len(command)
+    for mark in '@?=!':
+        pos = command.find(mark)
+        if pos != -1 and pos < end:
+            end = pos
+    return command[:end]
+
+
+def parse_addresses(text):
+    '''
+    '1-32' or '1,2,5-8' -> list of int
+    '''
+    addresses = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        addresses.extend(range(int(first), int(last or first) + 1))
+    return addresses
+
+
+def split_reply(frame):
+    '''
+    Splits a raw reply frame, Module:Register=Value@Address (e.g.
+    b'TC1:TCACTUALTEMP=25.30@3' or b'TC1:REPLY=1@3'), at its address.
+    Returns (head, address): head is the bytes before '@', address is str
+    ('' if the frame carries none).
+    '''
+    head, _, address = frame.rpartition(b'@')
+    return head, address.decode()
+
+
+# Reply handlers, one per command type. Each takes the head of a frame and
+# returns (status, value) in as few bytes operations as it needs.
+_OK = ('OK', None)
+_FAIL = ('FAIL', None)
+
+
+def _acknowledge(code):
+    suffix = b':REPLY=' + code
+
+    def handler(head):
+        return _OK if head.endswith(suffix) else _FAIL
+    handler.code = code
+    return handler
+
+
+def _value(head):
+    register, equals, value = head.partition(b'=')
+    if not equals or (value == b'2' and register.endswith(b':REPLY')):
+        return _FAIL
+    try:
+        return 'OK', float(value)
+    except ValueError:
+        return 'OK', value.decode('utf-8', 'replace')
+
+
+def _progress(head):
+    _, equals, value = head.partition(b'=')
+    try:
+        percent = int(value)
+    except ValueError:
+        return _FAIL
+    if percent == 100:
+        return 'OK', 100
+    return 'CONTINUE', percent
+
+
+def _unknown(head):
+    return _FAIL
+
+
+# type A: means reply=1 is OK
+# type V: means reply is value
+# type S: means reply=8 is value save OK
+# type R: just display reply from TMC
+# type P: PID autotune progress, 100 means finished
+REPLY_HANDLERS = {
+        'A': _acknowledge(b'1'),
+        'V': _value,
+        'S': _acknowledge(b'8'),
+        'R': _acknowledge(b'1'),
+        'P': _progress,
+        }
+
+
+def parse_reply(reply_type, reply):
+    '''
+    Interprets a raw reply frame (bytes) for a command of the given type.
+
+    Returns (status, value). status is OK, FAIL or CONTINUE (autotune still
+    running); value is the reported value of a V reply as float (str if it
+    is not numeric), the progress percentage of a P reply as int, None
+    otherwise.
+    '''
+    head, _ = split_reply(reply)
+    return REPLY_HANDLERS.get(reply_type, _unknown)(head)
+
+
+@lru_cache(maxsize=4096)
+def reply_matcher(command, reply_type):
+    '''
+    Returns match(head) for the replies to command: (status, value) as from
+    REPLY_HANDLERS if the head of a reply frame (as split by split_reply)
+    answers it, None if it is the reply to another command. Matching and
+    parsing take one call per frame: the expected heads are built here,
+    once per command.
+
+    A reply must come from the command's module type. V and P replies name
+    their register, Module:Register=Value, so they must also name the
+    command's register; a module's REPLY frame answers any type. Commands of
+    an unknown type take any reply of their module, which fails them.
+    '''
+    handler = REPLY_HANDLERS.get(reply_type, _unknown)
+    module = command[:command.find(':') + 1].encode()
+    acknowledge = module + b'REPLY='
+    if reply_type not in REPLY_HANDLERS:
+        acknowledge = module
+    if reply_type == 'V':
+        prefix = register_of(command).encode() + b'='
+        start = len(prefix)
+
+        def match(head):
+            # slice and compare is cheaper than startswith() in CPython
+            if head[:start] == prefix:
+                value = head[start:]
+                try:
+                    return 'OK', float(value)
+                except ValueError:
+                    return 'OK', value.decode('utf-8', 'replace')
+            if head.startswith(acknowledge):
+                return _value(head)
+            return None
+    elif reply_type == 'P':
+        prefix = register_of(command).encode() + b'='
+
+        def match(head):
+            if head.startswith(prefix) or head.startswith(acknowledge):
+                return _progress(head)
+            return None
+    elif hasattr(handler, 'code'):
+        ok = acknowledge + handler.code
+
+        def match(head):
+            if head == ok:
+                return _OK
+            if head.startswith(acknowledge):
+                return _FAIL
+            return None
+    else:
+        def match(head):
+            if head.startswith(acknowledge):
+                return _FAIL
+            return None
+    return match
+
+
+class CommandRequest:
+    '''
+    A single command sent to the bus. The reply parser records each reply on
+    it and wakes the scheduler; once the outcome is settled (after retries or
+    autotune polling) the request is finished, which wakes whoever waits on
+    it and runs its done callbacks.
+    '''
+
+    def __init__(self, command, reply_type, index=0, batch=None, value_name='', frame=None):
+        self.command = command
+        self.frame = frame or command.encode('utf-8') + b'\r'  # bytes on the wire
+        self.reply_type = reply_type
+        self.address = address_of(command)
+        self.address_key = self.address.encode()  # as it appears in replies
+        self.match = reply_matcher(command, reply_type)
+        self.index = index
+        self.batch = batch
+        self.value_name = value_name
+        self.retry = 0
+        self.timeouts = 0  # sends that timed out
+        self.timeout = 0.0  # reply timeout of the last send
+        self.deadline = 0.0
+        self.not_before = 0.0
+        self.status = 'PROCESS'
+        self.reply = b''
+        self.value = None
+        self.replied = False
+        self.sent_at = 0.0
+        self.rtt = None  # seconds from the last send to its reply (ambiguous once resent after a timeout)
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def complete(self, status, reply, value=None):
+        self.rtt = time.monotonic() - self.sent_at
+        self.reply = reply
+        self.value = value
+        self.status = status
+        self.replied = True
+
+    def finish(self, status=None):
+        '''
+        Settles the request: OK, FAIL or TIMEOUT.
+        '''
+        if status is not None:
+            self.status = status
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        '''
+        callback(request) runs once the request is finished, right away if it
+        already is.
+        '''
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def done(self):
+        return self._done.is_set()
+
+    def reset(self):
+        '''
+        Re-arms the request so it can be sent again (retry or progress poll).
+        '''
+        self.replied = False
+        self.status = 'PROCESS'
+
+    def wait(self, timeout=None):
+        '''
+        Blocks until the request is finished or timeout seconds elapse.
+        Returns True if it finished.
+        '''
+        return self._done.wait(timeout)
+
+
+class RTTEstimate:
+    '''
+    Round-trip estimate following TCP's retransmission timer (RFC 6298): a
+    smoothed RTT and its mean deviation, the reply timeout being
+    srtt + 4 * rttvar.
+    '''
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+
+    def observe(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    def timeout(self):
+        '''
+        Suggested reply timeout in seconds, None while nothing was measured.
+        '''
+        if self.srtt is None:
+            return None
+        return self.srtt + 4 * self.rttvar
+
+
+class AddressHealth:
+    '''
+    Round-trip estimates and circuit breaker of one module address (or of
+    the whole bus). RTT is estimated per reply type, as a save to EEPROM or
+    an autotune step takes far longer than a register read.
+
+    After `threshold` consecutive failures the breaker opens: commands for
+    the address are refused for `cooldown` seconds, then one is let through
+    again. Each time it reopens the cooldown doubles, up to cooldown_max.
+    '''
+
+    def __init__(self, threshold = 3, cooldown = 10.0, cooldown_max = 300.0):
+        self.estimates = {}  # reply type -> RTTEstimate
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.cooldown_max = cooldown_max
+        self.failures = 0  # consecutive
+        self.open_until = 0.0
+        self.quiet_until = 0.0  # a late reply to an earlier send may still come
+
+    def estimate(self, reply_type):
+        estimate = self.estimates.get(reply_type)
+        if estimate is None:
+            estimate = self.estimates[reply_type] = RTTEstimate()
+        return estimate
+
+    def succeeded(self):
+        self.failures = 0
+        self.cooldown = self.base_cooldown
+
+    def failed(self, now):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.open_until = now + self.cooldown
+            self.cooldown = min(self.cooldown * 2, self.cooldown_max)
+
+    def is_open(self, now):
+        return now < self.open_until
+
+
+class TCMController:
+    packet_serial = None
+
+    def __init__(self, port, baud_rate = 57600, window = 1):
+
+        ports = [p.device for p in list_ports.comports() if port == p.device]
+        if not ports and os.path.exists(port):
+            # not enumerated as a serial adapter, e.g. a pseudo-terminal
+            ports = [port]
+
+        if not ports:
+            raise ValueError(f"No device found at port: {port}")
+
+        self.packet_serial = serial.Serial(ports[0], baudrate=baud_rate, timeout=1)
+
+        self.instrumentstatus = InstrumentStatus()
+
+        self.lock = threading.RLock()
+        self.query_interval = 1.0  # PID autotune progress poll interval in seconds
+        self.reply_timeout = 5.0  # Seconds to wait for a reply before giving up
+        # Reply timeouts adapt to the measured round-trip time of each address
+        # and reply type (of the bus for those not heard from yet, reply_timeout
+        # when nothing was measured), at least min_reply_timeout. A command
+        # that timed out before reply_timeout is sent again, up to
+        # timeout_retries times, each time waiting twice as long.
+        self.min_reply_timeout = 0.5
+        self.timeout_retries = 2
+        self.health = {}  # address -> AddressHealth
+        self.bus_health = AddressHealth()
+        # FAIL replies are retried after retry_backoff * 2^(retry - 1) seconds,
+        # at most retry_backoff_max, randomised by up to half
+        self.retry_backoff = 0.02
+        self.retry_backoff_max = 1.0
+        # consecutive failures after which an address is refused for a while
+        self.breaker_threshold = 3
+        self.breaker_cooldown = 10.0
+        self.random = random.Random()
+        self.verbose = True  # print failed, timed out and refused commands
+        self.thread_read_received_packet = None
+        self.frame_reader = FrameReader(self.packet_serial)
+        self.bytes_sent = 0
+
+        # type A: means reply=1 is OK
+        # type V: means reply is value
+        # type S: means reply=8 is value save OK
+        # type R: just display reply from TMC
+        self.instruments = []
+
+        self.instrumentstatus.MAXinstrument = len(self.instruments)
+
+        # Pipelining: up to `window` requests are outstanding at once, each to
+        # a different address. Commands for one address stay in order.
+        self.window = window
+        self.queues = OrderedDict()  # address -> deque of pending CommandRequest
+        self.inflight = {}  # address -> CommandRequest waiting for its reply
+        self.routes = {}  # the same keyed by address bytes, as replies carry them
+        self.pending_reads = {}  # command -> unfinished submitted V request
+        # listener(request) runs on the controller thread for every finished
+        # request; keep it short, the bus waits for it
+        self.finish_listeners = []
+        # listener(name, text) gets every result the controller reports:
+        # read values by name, and 'Action' with OK/FAIL/TIMEOUT/ERROR when
+        # a command list ends; it runs on the controller threads
+        self.result_listeners = []
+        self.thread_run = None
+        self.condition = threading.Condition()
+        self.batch = None
+        self.batch_failure = None
+
+        self.running = True
+        self.thread_read_received_packet = threading.Thread(target=self.received_loop, daemon=True)
+        self.thread_read_received_packet.start()
+
+    def queue_depth(self):
+        '''
+        Number of commands waiting to be sent, in-flight ones excluded.
+        '''
+        with self.condition:
+            return sum(len(queue) for queue in self.queues.values()) - len(self.inflight)
+
+    def emit_result(self, name, text):
+        for listener in self.result_listeners:
+            listener(name, text)
+
+    def start(self):
+        self.thread_run = threading.Thread(target=self.run, daemon=True)
+        self.thread_run.start()
+
+    def wait(self, timeout = None):
+        '''
+        Waits for the scheduler thread to end; returns True if it has.
+        '''
+        if self.thread_run is not None:
+            self.thread_run.join(timeout)
+            return not self.thread_run.is_alive()
+        return True
+
+    def set_window(self, window):
+        with self.condition:
+            self.window = max(1, int(window))
+            self.condition.notify()
+
+    def set_commands(self, instruments_list):
+        with self.condition:
+            # a new command list replaces what has not been sent of the
+            # previous one; single submitted commands are kept
+            for address, queue in self.queues.items():
+                kept = deque()
+                for request in queue:
+                    if request.batch is None or self.inflight.get(address) is request:
+                        kept.append(request)
+                    else:
+                        self._settle(request, 'FAIL')
+                self.queues[address] = kept
+
+            self.batch = object()
+            self.batch_failure = None
+            self.instruments = instruments_list 
+            self.instrumentstatus.reset_value()
+            self.instrumentstatus.MAXinstrument = len(self.instruments)
+            self.instrumentstatus.status = 'INIT'
+            requests = []
+            for index, instrument in enumerate(self.instruments):
+                # a third element is the precompiled frame, see commandplan
+                frame = instrument[2] if len(instrument) > 2 else None
+                request = CommandRequest(instrument[0], instrument[1], index, self.batch, frame=frame)
+                if request.reply_type != 'V':
+                    self._close_reads(request.address)
+                self.queues.setdefault(request.address, deque()).append(request)
+                requests.append(request)
+            if not self.instruments:
+                # nothing to send, e.g. a differential write with no changes
+                self.instrumentstatus.status = 'FINISH'
+                self.emit_result('Action','OK')
+            self.condition.notify()
+            return requests
+
+    def submit(self, command, reply_type, value_name='', callback=None):
+        '''
+        Queues a single command alongside the current command list and
+        returns its CommandRequest. callback(request) runs once it is
+        finished; V values are reported to the result listeners only when
+        value_name is given.
+
+        A V command identical to one already queued or in flight is not sent
+        twice: the caller joins the existing request, unless a write to the
+        same address was queued in between.
+        '''
+        with self.condition:
+            request = self.pending_reads.get(command) if reply_type == 'V' else None
+            if request is None:
+                request = CommandRequest(command, reply_type, value_name=value_name)
+                if reply_type == 'V':
+                    self.pending_reads[command] = request
+                    request.add_done_callback(self._forget_read)
+                else:
+                    self._close_reads(request.address)
+                self.queues.setdefault(request.address, deque()).append(request)
+                self.condition.notify()
+            elif value_name and not request.value_name:
+                request.value_name = value_name
+        if callback is not None:
+            request.add_done_callback(callback)
+        return request
+
+    def _close_reads(self, address):
+        # reads queued before a write must not answer reads queued after it;
+        # a write to @0 may reach any module
+        for command, request in list(self.pending_reads.items()):
+            if address == '0' or request.address == address:
+                del self.pending_reads[command]
+
+    def _forget_read(self, request):
+        with self.condition:
+            if self.pending_reads.get(request.command) is request:
+                del self.pending_reads[request.command]
+
+    def set_return_value_name(self, value_name):
+        self.instrumentstatus.value_name = value_name
+
+    def transparent_command(self, command):
+        self.write_frames(command.encode('utf-8') + b'\x0D')
+
+    def write_frames(self, packet):
+        '''
+        Writes one or more CR-terminated frames with a single write call.
+        '''
+        with self.lock:
+            self.packet_serial.write(packet)
+            self.bytes_sent += len(packet)
+
+    def analyze_TCM_reply(self, reply):
+        if isinstance(reply, str):
+            reply = reply.encode('utf-8')
+        head, _, address = reply.rpartition(b'@')
+        # a query sent to @0 is answered by the module's own address; it is
+        # only ever in flight alone (see _dispatch). No lock: a request that
+        # left flight meanwhile is caught when completing it below
+        routes = self.routes
+        request = routes.get(address) or routes.get(b'0')
+        result = request.match(head) if request is not None and not request.replied else None
+        if result is None:
+            # nothing outstanding that this frame answers, e.g. a late reply
+            # to a request that already timed out: drop it
+            return
+
+        # save reply
+        self.instrumentstatus.reply = reply
+
+        status, value = result
+        if request.reply_type == 'P' and status != 'FAIL':
+            self.instrumentstatus.percent = str(value)
+            if status == 'OK':
+                self.instrumentstatus.value = value
+        elif request.reply_type == 'V' and status == 'OK':
+            self.instrumentstatus.value = value
+            value_name = request.value_name
+            if request.batch is not None:
+                value_name = self.instrumentstatus.value_name
+                print(value)
+            if value_name:
+                self.emit_result(value_name, str(value))
+
+        with self.condition:
+            # the sender may have given up on it while the reply was parsed
+            if self.inflight.get(request.address) is request and not request.replied:
+                request.complete(status, reply, value)
+                self.condition.notify()
+
+    def on_packet_received(self, packet):
+        self.analyze_TCM_reply(packet)
+
+    def received_loop(self):
+        reader = self.frame_reader
+        while self.running:
+            for frame in reader.read_frames():
+                self.on_packet_received(frame)
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify()
+        if self.thread_read_received_packet:
+            self.thread_read_received_packet.join()
+        if self.thread_run and self.thread_run is not threading.current_thread():
+            self.thread_run.join()
+
+        if self.packet_serial is not None:
+            self.packet_serial.close()
+
+    def _in_batch(self, request):
+        # part of the current command list, not a single submitted command
+        return request.batch is not None and request.batch is self.batch
+
+    def _health(self, address):
+        health = self.health.get(address)
+        if health is None:
+            health = self.health[address] = AddressHealth(self.breaker_threshold, self.breaker_cooldown)
+        return health
+
+    def _reply_timeout(self, address, reply_type, timeouts = 0):
+        # doubled for each earlier send of the command that timed out
+        timeout = self._health(address).estimate(reply_type).timeout()
+        if timeout is None:
+            timeout = self.bus_health.estimate(reply_type).timeout()
+        if timeout is None:
+            return self.reply_timeout
+        return min(self.reply_timeout, max(self.min_reply_timeout, timeout) * 2 ** timeouts)
+
+    def _retry_delay(self, retry):
+        delay = min(self.retry_backoff_max, self.retry_backoff * 2 ** (retry - 1))
+        return delay * self.random.uniform(0.5, 1.0)
+
+    def health_snapshot(self):
+        '''
+        Returns {address: {'rtt', 'failures', 'open'}}, 'rtt' being
+        {reply_type: {'srtt', 'rttvar', 'timeout'}}.
+        '''
+        with self.condition:
+            now = time.monotonic()
+            return {address: {
+                'rtt': {reply_type: {
+                    'srtt': estimate.srtt,
+                    'rttvar': estimate.rttvar,
+                    'timeout': self._reply_timeout(address, reply_type),
+                } for reply_type, estimate in health.estimates.items()},
+                'failures': health.failures,
+                'open': health.is_open(now),
+            } for address, health in self.health.items()}
+
+    def _refuse(self, address, queue):
+        # the breaker is open: fail without using the bus
+        if self.verbose:
+            print('Address ' + address + ' unavailable, refusing: ' + queue[0].command)
+        if any(self._in_batch(request) for request in queue):
+            self.batch_failure = self.batch_failure or 'FAIL'
+        self._drop_address(address)
+
+    def _dispatch(self, now):
+        # everything sent in one pass goes out in a single write
+        frames = []
+        if '0' in self.inflight:
+            # any module may answer @0, so nothing else goes out meanwhile
+            return
+        # a due @0 command waits for the bus to drain instead of starving
+        zero = self.queues.get('0')
+        draining = bool(zero) and zero[0].not_before <= now and not self._health('0').is_open(now)
+        for address, queue in list(self.queues.items()):
+            if not queue:
+                del self.queues[address]
+                continue
+            if address not in self.inflight and self._health(address).is_open(now):
+                self._refuse(address, queue)
+                continue
+            if len(self.inflight) >= self.window:
+                break
+            request = queue[0]
+            request.not_before = max(request.not_before, self._health(address).quiet_until)
+            if address in self.inflight or request.not_before > now:
+                continue
+            if draining and (address != '0' or self.inflight):
+                continue
+            request.timeout = self._reply_timeout(address, request.reply_type, request.timeouts)
+            request.deadline = now + request.timeout
+            request.sent_at = now
+            self.inflight[address] = request
+            self.routes[request.address_key] = request
+            if self._in_batch(request):
+                self.instrumentstatus.status = 'PROCESS'
+            frames.append(request.frame)
+            if request.batch is not None:
+                print('NO. ' + str(request.index + 1) 
+                      + ' Retry: ' + str(request.retry + 1) + ' Instrument: ' + request.command)
+            if address == '0':
+                break
+        if frames:
+            self.write_frames(b''.join(frames))
+
+    def _next_wakeup(self, now):
+        wakeup = [request.deadline for request in self.inflight.values()]
+        if len(self.inflight) < self.window:
+            wakeup += [queue[0].not_before for address, queue in self.queues.items()
+                       if queue and address not in self.inflight and queue[0].not_before > now]
+        if not wakeup:
+            return None
+        return max(0.0, min(wakeup) - now)
+
+    def _drop_address(self, address):
+        # later commands for a failed address depend on the failed one
+        queue = self.queues.pop(address, deque())
+        for request in queue:
+            if not request.done():
+                self._settle(request, 'FAIL')
+            self._account(request)
+
+    def _account(self, request):
+        if not self._in_batch(request):
+            return
+        self.instrumentstatus.instrumentIndex += 1
+        if self.instrumentstatus.instrumentIndex < self.instrumentstatus.MAXinstrument:
+            return
+        self.instrumentstatus.status = 'FINISH'
+        if self.batch_failure is None:
+            self.emit_result('Action','OK')
+            print('Instruction Excution Successfully')
+        elif self.batch_failure == 'TIMEOUT':
+            self.emit_result('Action','TIMEOUT')
+        else:
+            self.emit_result('Action','FAIL')
+
+    def _settle(self, request, status=None):
+        request.finish(status)
+        for listener in self.finish_listeners:
+            listener(request)
+
+    def _quiet(self, health, request, now):
+        # REPLY frames do not name the register: keep the next command off the
+        # address until a late answer to an earlier send of request is unlikely
+        health.quiet_until = now + self._reply_timeout(request.address, request.reply_type, request.timeouts)
+
+    def _finish(self, request, now):
+        address = request.address
+        del self.inflight[address]
+        del self.routes[request.address_key]
+        health = self._health(address)
+        if request.replied and not request.timeouts:
+            # a reply after a resend may answer the earlier send (Karn)
+            health.estimate(request.reply_type).observe(request.rtt)
+            self.bus_health.estimate(request.reply_type).observe(request.rtt)
+        elif request.replied and request.timeouts:
+            self._quiet(health, request, now)
+
+        if request.status == 'OK':
+            health.succeeded()
+            self.queues[address].popleft()
+            self._settle(request)
+            self._account(request)
+        elif request.status == 'FAIL':
+            if request.retry < self.instrumentstatus.MAXretry: 
+                request.retry += 1
+                request.reset()
+                request.not_before = now + self._retry_delay(request.retry)
+            else:
+                if self.verbose:
+                    print('Instruction Excution Fail: ' + request.command)
+                    print('Reply: ' + request.reply.decode('utf-8', 'replace'))
+                health.failed(now)
+                self._settle(request)
+                if self._in_batch(request):
+                    self.batch_failure = self.batch_failure or 'FAIL'
+                self._drop_address(address)
+        elif request.status == 'PROCESS':
+            if request.timeouts < self.timeout_retries and request.timeout < self.reply_timeout:
+                # e.g. a save slower than the reads the estimate came from;
+                # send it again, now waiting twice as long
+                request.timeouts += 1
+                request.retry += 1
+                request.reset()
+                return
+            self._quiet(health, request, now)
+            if self.verbose:
+                print('Instruction Excution Timeout: ' + request.command)
+            health.failed(now)
+            self._settle(request, 'TIMEOUT')
+            if self._in_batch(request):
+                self.batch_failure = 'TIMEOUT'
+            self._drop_address(address)
+        elif request.status == 'CONTINUE':
+            health.succeeded()
+            print('PID arguments tuning: %' + self.instrumentstatus.percent)
+            # autotune progress is polled, not pushed
+            request.reset()
+            request.not_before = now + self.query_interval
+        else:
+            print('Instruction Excution Unknown Error')
+            self.emit_result('Action','ERROR')
+            self._drop_address(address)
+
+    def run(self):
+        try:
+            while self.running is True:
+                with self.condition:
+                    now = time.monotonic()
+                    for request in list(self.inflight.values()):
+                        if request.replied or now >= request.deadline:
+                            self._finish(request, now)
+                    self._dispatch(now)
+                    self.condition.wait(self._next_wakeup(now))
+
+        except KeyboardInterrupt:
+            print("Stopping...")
+            self.stop()
+
+
+def assemble_commands(parameters_dict, current = None):
+    '''
+    Commands for one configuration row (Address, ModuleType,
+    AdjustTemperature1/2) as [command, reply_type] pairs.
+
+    current: state read back from the module, {parameter_name: value};
+             commands that would not change it are left out
+    '''
+    current = current or {}
+    command_sets = []
+    address = parameters_dict['Address']
+    moduletype = parameters_dict['ModuleType']
+    if moduletype == 'M207':
+        for channel in ('1', '2'):
+            adjusttemp = parameters_dict['AdjustTemperature' + channel]
+            if not _same_value(current.get('switch' + channel), '1'):
+                command_sets.append([f'TC{channel}:TCSW=1@{address}', 'A'])
+            if not _same_value(current.get('adjusttemperature' + channel), adjusttemp):
+                command_sets.append([f'TC{channel}:TCADJTEMP={adjusttemp}@{address}', 'A'])
+                command_sets.append([f'TC{channel}:TCADJTEMP!@{address}', 'S'])
+    return command_sets
+
+
+def assemble_instrument(instrument_dict):
+    device = instrument_dict['Device']
+    module = instrument_dict['Module']
+    register = instrument_dict['Register']
+    type = instrument_dict['Type']
+
+    if type == 'V':
+        return [f"{module}:{register}?@{device}", 'V'] 
+    else:
+        return None
+
+
+def _same_value(current, target):
+    if current is None:
+        return False
+    try:
+        return float(current) == float(target)
+    except ValueError:
+        return current == target
+
+
+class ReadCache:
+    '''
+    LRU cache of read values keyed by (address, 'Module:Register'), each
+    entry living for the TTL of the parameter it was read for. Writes to a
+    register invalidate its entry.
+    '''
+
+    def __init__(self, max_entries = 1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (address, register) -> (expires, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, address, command):
+        '''
+        Returns the cached value, or None if missing or expired.
+        '''
+        key = (str(address), register_of(command))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, address, command, value, ttl):
+        if ttl <= 0:
+            return
+        key = (str(address), register_of(command))
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, address, command):
+        with self.lock:
+            self.entries.pop((str(address), register_of(command)), None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class ControllerPool:
+    '''
+    One TCMController per serial port. Each controller drives its own bus on
+    its own threads, so all ports run in parallel; commands are routed to a
+    port through a module address -> port map.
+    '''
+
+    def __init__(self, ports, baud_rate = 57600, window = 1, port_map = None,
+                 controller_class = TCMController):
+        self.controllers = OrderedDict()
+        try:
+            for port in ports:
+                self.controllers[port] = controller_class(port, baud_rate, window)
+            self.default_port = ports[0]
+            # address -> port, addresses not listed go to the default port
+            self.port_map = {}
+            for address, port in (port_map or {}).items():
+                self.route(address, port)
+        except Exception:
+            # the ports opened so far would keep their receive threads running
+            self.stop()
+            raise
+
+    def route(self, address, port):
+        if port not in self.controllers:
+            raise ValueError(f"Port {port} is not part of the controller pool")
+        self.port_map[str(address)] = port
+
+    def port_for(self, address):
+        return self.port_map.get(str(address), self.default_port)
+
+    def controller_for(self, address):
+        return self.controllers[self.port_for(address)]
+
+    def start(self):
+        for controller in self.controllers.values():
+            controller.start()
+
+    def stop(self):
+        for controller in self.controllers.values():
+            controller.stop()
+
+
+class ControllerWrapper(): 
+
+    name_map_to_parameters_request_command = {
+            'temperature1':'TC1:TCACTUALTEMP?@0',
+            'temperature2':'TC2:TCACTUALTEMP?@0',
+            'voltage1':'TC1:TCACTUALVOLTAGE@0',
+            'voltage2':'TC2:TCACTUALVOLTAGE@0',
+            'current1':'TC1:TCACTCUR@0',
+            'current2':'TC2:TCACTCUR@0',
+            'adjusttemperature1':'TC1:TCADJTEMP?@0',
+            'adjusttemperature2':'TC2:TCADJTEMP?@0',
+            'protectHitemperature1':'TC1:TCOTPHT?@0',
+            'protectHitemperature2':'TC2:TCOTPHT?@0',
+            'switch1':'TC1:TCSW?@0',
+            'switch2':'TC2:TCSW?@0'
+            }
+
+    # state compared by write_parameters(diff=True)
+    diff_parameters = ['switch1', 'switch2', 'adjusttemperature1', 'adjusttemperature2']
+
+    # tcmcontroller.ControllerWrapper swaps in its Qt controller
+    controller_class = TCMController
+
+    controller = None
+    pool = None
+    cache = None
+    metrics = None
+
+    def __init__(self, simulation = False, window = 1, ports = None, port_map = None,
+                 cache_ttl = None, cache_size = 1024, metrics = False):
+        '''
+        window:   number of module addresses that may have a command in flight
+                  at the same time on one port (1 runs commands strictly one
+                  after another)
+        ports:    serial ports to drive, one controller each
+                  (default: /dev/ttyUSB0)
+        port_map: module address -> port; rows with a 'Port' column passed to
+                  write_parameters also update it
+        cache_ttl: parameter name -> seconds its reads stay valid, e.g.
+                  {'adjusttemperature1': 600}; enables the read cache.
+                  Parameters not listed, and reads sent to @0, are never
+                  cached
+        cache_size: maximum number of cached values (least recently used
+                  are evicted first)
+        metrics:  record latency, retry, timeout and bus metrics of every
+                  port in self.metrics (a metrics.ControllerMetrics)
+        '''
+        self.simulation = simulation
+        if cache_ttl is not None:
+            self.cache_ttl = dict(cache_ttl)
+            self.cache = ReadCache(cache_size)
+        if self.simulation is not True:
+            self.pool = ControllerPool(ports or ["/dev/ttyUSB0"], 57600, window, port_map,
+                                       self.controller_class)
+            # controller of the default port, kept for existing callers
+            self.controller = self.pool.controllers[self.pool.default_port]
+            if metrics:
+                self.metrics = ControllerMetrics()
+                for port, controller in self.pool.controllers.items():
+                    self.metrics.attach(controller, port)
+            self.pool.start()
+
+    @property
+    def controllers(self):
+        if self.pool is None:
+            return []
+        return list(self.pool.controllers.values())
+
+    def close(self):
+        if self.simulation is not True:
+            self.pool.stop()
+
+    def _assemble_commands(self, parameters_dict, current = None):
+        return assemble_commands(parameters_dict, current)
+
+    def _request_command(self, parameter_name, address):
+        command = self.name_map_to_parameters_request_command[parameter_name]
+        return command[:command.rfind('@') + 1] + str(address)
+
+    def submit_read(self, parameter_name, address, callback=None):
+        '''
+        Queues one read of parameter_name from the module at address without
+        replacing the current command list. Returns the CommandRequest, or
+        None in simulation.
+        '''
+        if self.simulation is True:
+            return None
+        command = self._request_command(parameter_name, address)
+        request = self.pool.controller_for(address).submit(command, 'V', callback=callback)
+        self._cache_when_done(parameter_name, request)
+        return request
+
+    def _cache_when_done(self, parameter_name, request):
+        # writes invalidate the module's real address, never @0
+        if self.cache is None or parameter_name not in self.cache_ttl or request.address == '0':
+            return
+        def store(request):
+            if request.status == 'OK':
+                self.cache.put(request.address, request.command, request.value,
+                               self.cache_ttl[parameter_name])
+        request.add_done_callback(store)
+
+    def _cached(self, parameter_name, address):
+        if self.cache is None or parameter_name not in self.cache_ttl or str(address) == '0':
+            return None
+        return self.cache.get(address, self._request_command(parameter_name, address))
+
+    def _invalidate_when_done(self, request):
+        def invalidate(request):
+            if request.status == 'OK':
+                self.cache.invalidate(request.address, request.command)
+        request.add_done_callback(invalidate)
+
+    def write_parameters(self, parameters_dict, diff = False): 
+        '''
+        Applies configuration rows (Address, ModuleType, AdjustTemperature1/2
+        and optionally Port).
+
+        diff: read the current switch and setpoint state of all modules in one
+              batch first (blocking) and send only the commands needed to
+              reach the target, skipping unchanged setpoints and their EEPROM
+              saves
+
+        Returns {'commands': commands queued, 'skipped': commands saved by diff}.
+        '''
+        rows = []
+        for item in parameters_dict:
+            if self.simulation is not True and item.get('Port'):
+                try:
+                    self.pool.route(item['Address'], item['Port'])
+                except ValueError as e:
+                    print(f"Skip address {item['Address']}: {e}")
+                    continue
+            rows.append(item)
+
+        current = {}
+        if diff:
+            addresses = [item['Address'] for item in rows if item['ModuleType'] == 'M207']
+            values = self.read_parameters_batch(self.diff_parameters, addresses)
+            for (address, parameter_name), value in values.items():
+                current.setdefault(address, {})[parameter_name] = value
+
+        report = {'commands': 0, 'skipped': 0}
+        commands_sets = OrderedDict()
+        for item in rows:
+            port = None
+            if self.simulation is not True:
+                port = self.pool.port_for(item['Address'])
+            _sets = self._assemble_commands(item, current.get(str(item['Address'])))
+            if diff:
+                report['skipped'] += len(self._assemble_commands(item)) - len(_sets)
+            report['commands'] += len(_sets)
+            commands_sets.setdefault(port, []).extend(_sets)
+        if self.simulation is not True:
+            # every bus runs its share of the configuration in parallel
+            for port, commands in commands_sets.items():
+                requests = self.pool.controllers[port].set_commands(commands)
+                if self.cache is not None:
+                    for request in requests:
+                        if request.reply_type in ('A', 'S'):
+                            self._invalidate_when_done(request)
+        if diff:
+            print(f"Differential write: {report['commands']} commands, {report['skipped']} skipped")
+        return report
+
+    def apply_plan(self, plan):
+        '''
+        Sends a compiled commandplan.CommandPlan as the command list of every
+        port it addresses, reusing its encoded frames. Rows with a Port
+        column update the routing as in write_parameters.
+
+        Returns {'commands': commands queued}.
+        '''
+        commands_sets = OrderedDict()
+        for index, address in enumerate(plan.addresses()):
+            port = None
+            if self.simulation is not True:
+                if plan.ports[index]:
+                    try:
+                        self.pool.route(address, plan.ports[index])
+                    except ValueError as e:
+                        print(f"Skip address {address}: {e}")
+                        continue
+                port = self.pool.port_for(address)
+            commands_sets.setdefault(port, []).append(index)
+
+        report = {'commands': sum(len(indexes) for indexes in commands_sets.values())}
+        if self.simulation is not True:
+            for port, indexes in commands_sets.items():
+                requests = self.pool.controllers[port].set_commands(plan.entries(indexes))
+                if self.cache is not None:
+                    for request in requests:
+                        if request.reply_type in ('A', 'S'):
+                            self._invalidate_when_done(request)
+        return report
+
+    def read_parameters(self, parameter_name, address = 0):
+        '''
+        Reads one parameter; the value is reported to the result listeners.
+        Reads are queued next to any running command list instead of
+        replacing it.
+
+        parameter_name:
+            temperature1
+            temperature2
+            voltage1
+            voltage2
+            current1
+            current2
+            adjusttemperature1
+            adjusttemperature2
+            protectHitemperature1
+            protectHitemperature2
+            switch1
+            switch2
+        '''
+        command = self._request_command(parameter_name, address)
+
+        if self.simulation is not True:
+            controller = self.pool.controller_for(address)
+            value = self._cached(parameter_name, address)
+            if value is not None:
+                controller.emit_result(parameter_name, str(value))
+                return
+            request = controller.submit(command, 'V', value_name=parameter_name)
+            self._cache_when_done(parameter_name, request)
+
+    def read_parameters_batch(self, parameter_names, addresses, timeout = None):
+        '''
+        Reads every parameter in parameter_names from every module in
+        addresses and blocks until all replies are in (or timeout seconds).
+        Duplicate pairs are read once and reads already queued or in flight
+        are joined rather than sent again; all ports are read in parallel.
+
+        Returns {(address, parameter_name): value}, value is None for reads
+        that failed, timed out or did not finish in time.
+        '''
+        results = {}
+        requests = OrderedDict()
+        for address in addresses:
+            for parameter_name in parameter_names:
+                key = (str(address), parameter_name)
+                if key in requests or key in results:
+                    continue
+                value = self._cached(parameter_name, address)
+                if value is not None:
+                    results[key] = value
+                else:
+                    requests[key] = self.submit_read(parameter_name, address)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for key, request in requests.items():
+            if request is None:
+                results[key] = None
+                continue
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if request.wait(remaining) and request.status == 'OK':
+                results[key] = request.value
+            else:
+                results[key] = None
+        return results
+
@@ -0,0 +1,187 @@
+#! /usr/bin/env python3
+# coding=utf-8
+
+"""
+ description:	headless TCM daemon without Qt. Applies CSV configurations
+ 		and streams sampled telemetry as JSON lines on stdout, optionally
+ 		recording it and exporting metrics.
+ usage:		python -m tcmdaemon --port /dev/ttyUSB0 | --discover [--config instruments.csv]
+ 		    [--sample temperature1,temperature2:1.0] [--addresses 1-32]
+ 		    [--record DIR] [--metrics tcm.prom]
+"""
+
+
+import argparse
+import json
+import logging
+import signal
+import sys
+import threading
+
+from commandplan import compile_plan
+from csvwrapper import CSVHandler
+from discovery import DEFAULT_CACHE, discover, port_map
+from sampler import TelemetrySampler
+from tcmcore import ControllerWrapper, parse_addresses
+
+
+class BatchWaiter:
+    '''
+    Finish listener counting settled command-list requests, so a CSV
+    configuration can be waited for.
+    '''
+
+    def __init__(self):
+        self.finished = 0
+        self.changed = threading.Condition()
+
+    def __call__(self, request):
+        if request.batch is None:
+            return
+        with self.changed:
+            self.finished += 1
+            self.changed.notify_all()
+
+    def wait_for(self, count, timeout = None):
+        with self.changed:
+            return self.changed.wait_for(lambda: self.finished >= count, timeout)
+
+    def reset(self):
+        with self.changed:
+            self.finished = 0
+
+
+def apply_config(wrapper, waiter, path, diff, timeout):
+    if diff:
+        # the commands depend on the modules' current state
+        rows = CSVHandler(path).read_csv()
+        if not rows:
+            logging.error(f"No rows in configuration {path}")
+            return False
+        waiter.reset()
+        report = wrapper.write_parameters(rows, diff=diff)
+    else:
+        plan = compile_plan(path)
+        if not len(plan):
+            logging.error(f"No commands in configuration {path}")
+            return False
+        waiter.reset()
+        report = dict(wrapper.apply_plan(plan), skipped=0)
+    if not waiter.wait_for(report['commands'], timeout):
+        logging.error(f"Configuration {path} did not finish within {timeout} s")
+        return False
+    logging.info(f"Applied {path}: {report['commands']} commands, {report['skipped']} skipped")
+    return True
+
+
+def parse_sample(text):
+    '''
+    'temperature1,temperature2:1.0' -> (['temperature1', 'temperature2'], 1.0)
+    '''
+    names, _, rate = text.partition(':')
+    return names.split(','), float(rate or 1.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='headless TCM daemon')
+    parser.add_argument('--port', action='append', dest='ports',
+                        help='serial port to drive, repeat for several USB-serial adapters')
+    parser.add_argument('--simulation', action='store_true',
+                        help='run against simulated modules on a pseudo-terminal')
+    parser.add_argument('--discover', action='store_true',
+                        help='find ports and module addresses (cached between runs)')
+    parser.add_argument('--refresh-topology', action='store_true',
+                        help='scan again instead of using the cached topology')
+    parser.add_argument('--window', type=int, default=1)
+    parser.add_argument('--config', action='append', default=[],
+                        help='CSV configuration to apply at startup, repeatable')
+    parser.add_argument('--diff', action='store_true', help='only send parameters that differ')
+    parser.add_argument('--config-timeout', type=float, default=60.0)
+    parser.add_argument('--sample', action='append', default=[],
+                        help="'name[,name...]:rate' to sample, rate in reads per second")
+    parser.add_argument('--addresses', default='1', help="module addresses to sample, e.g. '1-32'")
+    parser.add_argument('--record', help='directory to record samples to')
+    parser.add_argument('--metrics', help='file to export Prometheus metrics to')
+    parser.add_argument('--metrics-interval', type=float, default=10.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    # stdout carries telemetry; the controller's progress prints go to stderr
+    telemetry, sys.stdout = sys.stdout, sys.stderr
+
+    simulator = None
+    ports = args.ports
+    if args.simulation:
+        # the simulator is only needed for simulation runs
+        from simulator import TCMSimulator
+        simulator = TCMSimulator()
+        ports = [simulator.start()]
+        logging.info(f"Simulating {len(simulator.modules)} modules on {ports[0]}")
+
+    addresses = None
+    if args.discover:
+        # simulated ports are new every run, never cache them
+        topology = discover(ports, cache_path=None if args.simulation else DEFAULT_CACHE,
+                            refresh=args.refresh_topology)
+        if not topology:
+            logging.error("No modules found")
+            sys.exit(1)
+        for port, found in topology.items():
+            logging.info(f"{port}: {','.join(found)}")
+        ports = list(topology)
+        addresses = port_map(topology)
+
+    wrapper = ControllerWrapper(window=args.window, ports=ports, port_map=addresses,
+                                metrics=bool(args.metrics))
+    waiter = BatchWaiter()
+    for controller in wrapper.controllers:
+        controller.finish_listeners.append(waiter)
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+    sampler = None
+    recorder = None
+    try:
+        for path in args.config:
+            apply_config(wrapper, waiter, path, args.diff, args.config_timeout)
+
+        if args.sample:
+            sampler = TelemetrySampler(wrapper)
+            addresses = parse_addresses(args.addresses)
+            for text in args.sample:
+                names, rate = parse_sample(text)
+                for name in names:
+                    sampler.add(name, addresses, rate)
+
+            def emit(address, name, value, timestamp):
+                telemetry.write(json.dumps({'timestamp': timestamp, 'address': address,
+                                            'parameter': name, 'value': value}) + '\n')
+                telemetry.flush()
+            sampler.add_listener(emit)
+
+            if args.record:
+                # numpy is only needed when recording
+                from recorder import TelemetryRecorder
+                recorder = TelemetryRecorder(args.record)
+                recorder.start()
+                sampler.add_listener(recorder.add)
+            sampler.start()
+
+        while (sampler is not None or args.metrics) and not stopping.is_set():
+            stopping.wait(args.metrics_interval if args.metrics else 1.0)
+            if args.metrics:
+                wrapper.metrics.write_prometheus(args.metrics)
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        if recorder is not None:
+            recorder.stop()
+        wrapper.close()
+        if simulator is not None:
+            simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+ description:	AsyncTCMClient against simulated modules.
+ usage:		python -m pytest tests
+"""
+
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulator import TCMSimulator
+from tcmasync import open_client
+
+
+class AsyncClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = TCMSimulator(addresses=range(1, 5), latency=0.002, jitter=0.004, seed=1)
+        self.port = self.simulator.start()
+
+    def tearDown(self):
+        self.simulator.stop()
+
+    def run_client(self, work, window = 8, reply_timeout = 1.0):
+        async def main():
+            client = await open_client(self.port, window=window, reply_timeout=reply_timeout)
+            try:
+                return await work(client)
+            finally:
+                client.close()
+        return asyncio.run(main())
+
+    def test_query_to_zero_is_not_credited_to_another_address(self):
+        async def work(client):
+            return [await asyncio.gather(client.query('TC1:TCACTUALTEMP?', 0),
+                                         client.query('TC1:TCOTPHT?', 1))
+                    for _ in range(20)]
+        for temperature, protection in self.run_client(work):
+            self.assertAlmostEqual(temperature, 25.0, delta=0.1)
+            self.assertEqual(protection, 70.0)
+
+    def test_pipelined_queries(self):
+        async def work(client):
+            await asyncio.gather(*[client.write(f'TC1:TCADJTEMP={30 + address}', address)
+                                   for address in range(1, 5)])
+            return await asyncio.gather(*[client.query('TC1:TCADJTEMP?', address)
+                                          for address in range(1, 5) for _ in range(5)])
+        self.assertEqual(self.run_client(work), [30.0 + address for address in range(1, 5) for _ in range(5)])
+
+    def test_late_reply_is_not_credited_to_the_next_query(self):
+        async def work(client):
+            self.simulator.latency = 0.15
+            with self.assertRaises(asyncio.TimeoutError):
+                await client.query('TC1:TCADJTEMP?', 1, timeout=0.05)
+            self.simulator.latency = 0.002
+            return await client.query('TC1:TCOTPHT?', 2)
+        self.assertEqual(self.run_client(work), 70.0)
+
+    def test_unknown_reply_type_fails(self):
+        async def work(client):
+            return await client.request('TC1:TCSW?', 'Z', 1)
+        self.assertEqual(self.run_client(work)[0], 'FAIL')
+
+
+if __name__ == '__main__':
+    unittest.main()
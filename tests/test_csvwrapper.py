@@ -0,0 +1,120 @@
+"""
+ description:	CSVHandler updates, the update journal and its replay.
+ usage:		python -m pytest tests
+"""
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csvwrapper import CSVHandler
+
+
+FIELDNAMES = ['Device', 'Address', 'Temperature']
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'devices.csv')
+        CSVHandler(self.path).write_csv([{'Device': f'TC{n}', 'Address': str(n), 'Temperature': '20'}
+                                         for n in range(1, 4)], FIELDNAMES)
+        with open(self.path, 'rb') as file:
+            self.original = file.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def file_contents(self):
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+    def test_updates_go_to_the_journal_and_are_replayed(self):
+        handler = CSVHandler(self.path, journal=True)
+        self.assertTrue(handler.update_row({'Address': '2'}, {'Temperature': '35'}))
+        self.assertEqual(self.file_contents(), self.original)
+        self.assertTrue(os.path.exists(handler.journal_path))
+        # a fresh handler sees the journaled change
+        rows = CSVHandler(self.path, journal=True).read_csv()
+        self.assertEqual([row['Temperature'] for row in rows], ['20', '35', '20'])
+
+    def test_batches_replay_in_order(self):
+        handler = CSVHandler(self.path, journal=True)
+        # the second batch matches the address the first one wrote
+        self.assertEqual(handler.update_rows([({'Device': 'TC1'}, {'Address': '9'})]), 1)
+        self.assertEqual(handler.update_rows([({'Address': '9'}, {'Temperature': '50'})]), 1)
+        rows = CSVHandler(self.path, journal=True).read_csv()
+        self.assertEqual(rows[0], {'Device': 'TC1', 'Address': '9', 'Temperature': '50'})
+        # as_dict=False replays the same way
+        table = CSVHandler(self.path, journal=True).read_csv(as_dict=False)
+        self.assertEqual(table[1], ['TC1', '9', '50'])
+
+    def test_torn_last_line_is_ignored(self):
+        handler = CSVHandler(self.path, journal=True)
+        handler.update_row({'Address': '3'}, {'Temperature': '40'})
+        with open(handler.journal_path, 'a') as file:
+            file.write('[[{"Address": "1"}, {"Tempera')
+        rows = CSVHandler(self.path, journal=True).read_csv()
+        self.assertEqual([row['Temperature'] for row in rows], ['20', '20', '40'])
+
+    def test_compact_writes_the_journal_into_the_file(self):
+        handler = CSVHandler(self.path, journal=True)
+        handler.update_row({'Address': '1'}, {'Temperature': '30'})
+        handler.compact()
+        self.assertFalse(os.path.exists(handler.journal_path))
+        rows = CSVHandler(self.path).read_csv()
+        self.assertEqual([row['Temperature'] for row in rows], ['30', '20', '20'])
+
+    def test_journal_compacts_at_its_size_limit(self):
+        handler = CSVHandler(self.path, journal=True, journal_max_bytes=100)
+        for value in range(10):
+            handler.update_row({'Address': '1'}, {'Temperature': str(value)})
+        self.assertNotEqual(self.file_contents(), self.original)
+        if os.path.exists(handler.journal_path):
+            self.assertLess(os.path.getsize(handler.journal_path), 100)
+        rows = CSVHandler(self.path, journal=True).read_csv()
+        self.assertEqual(rows[0]['Temperature'], '9')
+
+    def test_cached_handler_sees_journal_of_another(self):
+        cached = CSVHandler(self.path, cached=True, index_columns=['Address'], journal=True)
+        self.assertEqual(cached.filter_data({'Address': '2'})[0]['Temperature'], '20')
+        CSVHandler(self.path, journal=True).update_row({'Address': '2'}, {'Temperature': '45'})
+        self.assertEqual(cached.filter_data({'Address': '2'})[0]['Temperature'], '45')
+        self.assertEqual(cached.get_column('Temperature'), ['20', '45', '20'])
+
+
+class WriteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'devices.csv')
+        self.rows = [{'Device': f'TC{n}', 'Address': str(n), 'Temperature': '20'} for n in range(1, 4)]
+        CSVHandler(self.path).write_csv(self.rows, FIELDNAMES)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_failed_rewrite_keeps_the_file_and_reports(self):
+        handler = CSVHandler(self.path)
+        # a column the file does not have, on a row after the first, makes
+        # DictWriter raise ValueError
+        self.assertFalse(handler.update_row({'Address': '3'}, {'New': '1'}))
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        self.assertEqual(handler.read_csv(), self.rows)
+
+    def test_failed_write_csv_returns_false(self):
+        handler = CSVHandler(self.path)
+        self.assertFalse(handler.write_csv([{'Other': 'x'}], FIELDNAMES))
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        self.assertTrue(handler.write_csv([{'Device': 'TC4', 'Address': '4', 'Temperature': '21'}],
+                                          FIELDNAMES))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+"""
+ description:	discovery scans against simulated modules.
+ usage:		python -m pytest tests
+"""
+
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from discovery import scan
+from simulator import TCMSimulator
+
+
+class ScanTest(unittest.TestCase):
+
+    def scan_simulated(self, latency, timeout):
+        simulator = TCMSimulator(addresses=[1, 7], latency=latency)
+        port = simulator.start()
+        try:
+            found = scan([port], range(1, 11), timeout=timeout).get(port, [])
+            self.probes = simulator.commands
+            return found
+        finally:
+            simulator.stop()
+
+    def test_finds_modules(self):
+        self.assertEqual(self.scan_simulated(latency=0.005, timeout=0.1), ['1', '7'])
+        # missing addresses are probed once, not resent
+        self.assertEqual(self.probes, 10)
+
+    def test_late_replies_do_not_invent_modules(self):
+        # replies arrive after the probe timed out, while the next address
+        # is being probed; they must not be credited to it
+        found = self.scan_simulated(latency=0.15, timeout=0.1)
+        self.assertTrue(set(found) <= {'1', '7'}, found)
+
+
+if __name__ == '__main__':
+    unittest.main()
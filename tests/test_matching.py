@@ -0,0 +1,80 @@
+"""
+ description:	reply matching and pipelining of TCMController against
+ 		simulated modules.
+ usage:		python -m pytest tests
+"""
+
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulator import TCMSimulator
+from tcmcore import TCMController, reply_matcher
+
+
+class ReplyMatcherTest(unittest.TestCase):
+
+    def test_value_reply_must_name_the_register(self):
+        match = reply_matcher('TC1:TCOTPHT?@1', 'V')
+        self.assertEqual(match(b'TC1:TCOTPHT=70'), ('OK', 70.0))
+        self.assertIsNone(match(b'TC1:TCACTUALTEMP=25.03'))
+        self.assertIsNone(match(b'TC2:TCOTPHT=70'))
+        self.assertEqual(match(b'TC1:REPLY=2'), ('FAIL', None))
+
+    def test_acknowledge_must_come_from_the_module_type(self):
+        match = reply_matcher('TC2:TCADJTEMP=30@1', 'A')
+        self.assertEqual(match(b'TC2:REPLY=1'), ('OK', None))
+        self.assertEqual(match(b'TC2:REPLY=2'), ('FAIL', None))
+        self.assertIsNone(match(b'TC1:REPLY=1'))
+        self.assertIsNone(match(b'TC2:TCADJTEMP=30'))
+
+
+class PipeliningTest(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = TCMSimulator(addresses=range(1, 5), latency=0.002, jitter=0.004, seed=1)
+        self.controller = TCMController(self.simulator.start(), window=4)
+        self.controller.start()
+
+    def tearDown(self):
+        self.controller.stop()
+        self.simulator.stop()
+
+    def test_query_to_zero_is_not_credited_to_another_address(self):
+        for _ in range(20):
+            broadcast = self.controller.submit('TC1:TCACTUALTEMP?@0', 'V')
+            protection = self.controller.submit('TC1:TCOTPHT?@1', 'V')
+            self.assertTrue(broadcast.wait(5) and protection.wait(5))
+            self.assertEqual(broadcast.status, 'OK')
+            self.assertEqual((protection.status, protection.value), ('OK', 70.0))
+
+    def test_commands_of_one_address_run_in_order(self):
+        finished = []
+        all_finished = threading.Event()
+
+        def record(request):
+            # listeners run after the request is done, so wait() alone races them
+            finished.append(request)
+            if len(finished) == 80:
+                all_finished.set()
+        self.controller.finish_listeners.append(record)
+        requests = []
+        for step in range(10):
+            for address in range(1, 5):
+                requests.append(self.controller.submit(f'TC1:TCADJTEMP={30 + step}@{address}', 'A'))
+                requests.append(self.controller.submit(f'TC1:TCADJTEMP?@{address}', 'V'))
+        self.assertTrue(all_finished.wait(10))
+        for address in ('1', '2', '3', '4'):
+            own = [request for request in requests if request.address == address]
+            self.assertEqual([request for request in finished if request.address == address], own)
+            # every read sees the write queued just before it
+            reads = [request.value for request in own if request.reply_type == 'V']
+            self.assertEqual(reads, [30.0 + step for step in range(10)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+ description:	timeouts, resends and the circuit breaker of TCMController
+ 		against simulated modules.
+ usage:		python -m pytest tests
+"""
+
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulator import TCMSimulator
+from tcmcore import TCMController
+
+
+class SlowSaveSimulator(TCMSimulator):
+    save_latency = 0.002
+
+    def _due(self, reply, now):
+        if 'REPLY=8' in reply:
+            return now + self.save_latency
+        return super()._due(reply, now)
+
+
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = SlowSaveSimulator(addresses=[1], latency=0.002)
+        self.controller = TCMController(self.simulator.start(), window=4)
+        self.controller.verbose = False
+        self.controller.reply_timeout = 0.4
+        self.controller.min_reply_timeout = 0.05
+        self.controller.start()
+
+    def tearDown(self):
+        self.controller.stop()
+        self.simulator.stop()
+
+    def run_commands(self, *commands):
+        requests = [self.controller.submit(command, reply_type) for command, reply_type in commands]
+        for request in requests:
+            self.assertTrue(request.wait(5))
+        return requests
+
+    def test_unmeasured_dead_address_is_not_resent(self):
+        requests = self.run_commands(*[(f'TC1:TCSW?@{address}', 'V') for address in range(2, 10)])
+        self.assertEqual([request.status for request in requests], ['TIMEOUT'] * 8)
+        # each waited the full reply_timeout once, there is nothing longer to wait
+        self.assertEqual(self.simulator.commands, 8)
+
+    def test_slow_save_is_resent_and_its_late_reply_dropped(self):
+        self.run_commands(*[('TC1:TCADJTEMP!@1', 'S')] * 3)
+        sent = self.simulator.commands
+        self.simulator.save_latency = 0.12
+        save, read = self.run_commands(('TC1:TCADJTEMP!@1', 'S'), ('TC1:TCOTPHT?@1', 'V'))
+        self.assertEqual((save.status, save.timeouts), ('OK', 1))
+        self.assertEqual((read.status, read.value), ('OK', 70.0))
+        self.assertEqual(self.simulator.commands - sent, 3)
+        self.assertEqual(self.controller.health['1'].failures, 0)
+
+    def test_breaker_refuses_after_repeated_failures(self):
+        self.controller.breaker_threshold = 2
+        self.simulator.error_rate = 1.0
+        self.controller.retry_backoff = 0.001
+        # one at a time: a failed command fails the rest of its address's queue
+        for _ in range(2):
+            failed, = self.run_commands(('TC1:TCSW=1@1', 'A'))
+            self.assertEqual(failed.status, 'FAIL')
+        sent = self.simulator.commands
+        refused, = self.run_commands(('TC1:TCSW=1@1', 'A'))
+        self.assertEqual(refused.status, 'FAIL')
+        self.assertEqual(self.simulator.commands, sent)
+
+
+if __name__ == '__main__':
+    unittest.main()
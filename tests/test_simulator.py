@@ -0,0 +1,60 @@
+"""
+ description:	timing of the simulated bus: replies of different modules
+ 		share the wire and are sent one after another.
+ usage:		python -m pytest tests
+"""
+
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulator import TCMSimulator
+from tcmcore import TCMController
+
+
+class BusClockTest(unittest.TestCase):
+
+    def test_replies_queue_behind_each_other(self):
+        simulator = TCMSimulator(addresses=[1, 2, 3], latency=0.001, baud_rate=9600)
+        reply = 'TC1:TCACTUALTEMP=25.00@1'
+        transmission = (len(reply) + 1) * 10.0 / 9600
+        now = 100.0
+        due = [simulator._due(reply, now) for _ in range(3)]
+        self.assertAlmostEqual(due[0], now + 0.001 + transmission)
+        self.assertAlmostEqual(due[1] - due[0], transmission)
+        self.assertAlmostEqual(due[2] - due[1], transmission)
+        # an idle bus does not delay the next reply
+        self.assertAlmostEqual(simulator._due(reply, 200.0), 200.0 + 0.001 + transmission)
+
+    def test_no_transmission_time_without_baud_rate(self):
+        simulator = TCMSimulator(addresses=[1, 2], latency=0.001)
+        self.assertEqual(simulator._due('TC1:REPLY=1@1', 100.0), 100.001)
+        self.assertEqual(simulator._due('TC1:REPLY=1@2', 100.0), 100.001)
+
+    def test_pipelined_reads_are_bounded_by_the_bus(self):
+        # 16 replies of at least 20 bytes at 9600 baud need 0.33 s on the wire
+        # however many of them are in flight
+        simulator = TCMSimulator(addresses=range(1, 17), latency=0.001, baud_rate=9600)
+        controller = TCMController(simulator.start(), window=8)
+        controller.verbose = False
+        controller.start()
+        try:
+            started = time.monotonic()
+            requests = [controller.submit(f'TC1:TCACTUALTEMP?@{address}', 'V')
+                        for address in range(1, 17)]
+            for request in requests:
+                self.assertTrue(request.wait(5))
+            elapsed = time.monotonic() - started
+        finally:
+            controller.stop()
+            simulator.stop()
+        self.assertEqual([request.status for request in requests], ['OK'] * 16)
+        self.assertGreaterEqual(elapsed, 16 * 20 * 10.0 / 9600)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+"""
+ description:	bounded in-process store for sampled values. Every
+ 		(address, parameter) series lives in preallocated NumPy ring
+ 		buffers, so memory stays fixed however long the monitor runs.
+"""
+
+
+import threading
+import time
+
+import numpy as np
+
+
+class RingBuffer:
+    '''
+    Fixed-capacity float64 timestamps and values; the oldest samples are
+    overwritten once it is full.
+    '''
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = np.empty(capacity, dtype=np.float64)
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.head = 0  # next slot to write
+        self.count = 0
+
+    def append(self, timestamp, value):
+        self.timestamps[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def ordered(self):
+        '''
+        Returns (timestamps, values) oldest first. Views while the buffer has
+        not wrapped yet, copies afterwards.
+        '''
+        if self.count < self.capacity:
+            return self.timestamps[:self.count], self.values[:self.count]
+        order = np.r_[self.head:self.capacity, 0:self.head]
+        return self.timestamps[order], self.values[order]
+
+    def latest(self):
+        if self.count == 0:
+            return None
+        last = self.head - 1
+        return float(self.timestamps[last]), float(self.values[last])
+
+
+class TimeSeriesStore:
+    '''
+    Samples per (address, parameter), each series holding the last
+    `capacity` samples (or capacities[parameter] if given). Its add() matches
+    the TelemetrySampler listener signature:
+
+        store = TimeSeriesStore(capacity=3600, capacities={'temperature1': 18000})
+        sampler.add_listener(store.add)
+        store.stats('3', 'temperature1', start=time.time() - 60)
+    '''
+
+    def __init__(self, capacity = 3600, capacities = None):
+        self.capacity = capacity
+        self.capacities = dict(capacities or {})
+        self.buffers = {}  # (address, parameter) -> RingBuffer
+        self.lock = threading.Lock()
+
+    def add(self, address, parameter, value, timestamp = None):
+        '''
+        Stores one sample. Returns False if value is not numeric.
+        '''
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+        if timestamp is None:
+            timestamp = time.time()
+        key = (str(address), parameter)
+        with self.lock:
+            buffer = self.buffers.get(key)
+            if buffer is None:
+                buffer = RingBuffer(self.capacities.get(parameter, self.capacity))
+                self.buffers[key] = buffer
+            buffer.append(timestamp, value)
+        return True
+
+    def series(self):
+        with self.lock:
+            return list(self.buffers)
+
+    def memory_bytes(self):
+        with self.lock:
+            return sum(buffer.timestamps.nbytes + buffer.values.nbytes
+                       for buffer in self.buffers.values())
+
+    def latest(self, address, parameter):
+        '''
+        Returns (timestamp, value) of the newest sample, or None.
+        '''
+        with self.lock:
+            buffer = self.buffers.get((str(address), parameter))
+            return None if buffer is None else buffer.latest()
+
+    def window(self, address, parameter, start = None, end = None):
+        '''
+        Returns (timestamps, values) with start <= timestamp <= end, oldest
+        first. Open bounds take the whole buffer.
+        '''
+        with self.lock:
+            buffer = self.buffers.get((str(address), parameter))
+            if buffer is None:
+                empty = np.empty(0, dtype=np.float64)
+                return empty, empty
+            timestamps, values = buffer.ordered()
+            first = 0 if start is None else np.searchsorted(timestamps, start, 'left')
+            last = len(timestamps) if end is None else np.searchsorted(timestamps, end, 'right')
+            return timestamps[first:last].copy(), values[first:last].copy()
+
+    def stats(self, address, parameter, start = None, end = None):
+        '''
+        Returns count, mean, min and max over a time window, or None if the
+        window holds no samples.
+        '''
+        _, values = self.window(address, parameter, start, end)
+        if len(values) == 0:
+            return None
+        return {
+            'count': len(values),
+            'mean': float(values.mean()),
+            'min': float(values.min()),
+            'max': float(values.max()),
+        }
+
+    def decimate(self, address, parameter, buckets, start = None, end = None):
+        '''
+        Min/max decimation for plotting: splits the window into `buckets`
+        equal time slots and returns (timestamps, minimums, maximums), one
+        entry per non-empty slot, timestamped with its first sample.
+        '''
+        timestamps, values = self.window(address, parameter, start, end)
+        if len(values) == 0:
+            return timestamps, values, values
+        edges = np.linspace(timestamps[0], timestamps[-1], buckets + 1)[:-1]
+        first = np.unique(np.searchsorted(timestamps, edges, 'left'))
+        return (timestamps[first],
+                np.minimum.reduceat(values, first),
+                np.maximum.reduceat(values, first))